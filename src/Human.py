@@ -8,10 +8,27 @@ If you have any question, pls contact me
 at djh113@126.com
 """
 
+import copy
 import os
+import threading
 from board import *
 import mcts
-from policyValueNet import ValueNet
+from endgame import Solver
+
+
+def load_net(model_path: str, backend='tf', width=8, height=8):
+    """
+    network for playing
+    backend: 'tf' (ValueNet, inference mode) or 'numpy' (NumpyNet, no Tensorflow),
+    the reduced precision nets of quantize.py are for evaluation only
+    """
+    assert backend in ('tf', 'numpy'), 'Invalid backend!'
+    if backend == 'numpy':
+        from numpyNet import NumpyNet
+        return NumpyNet(width, height, model_path)
+    # Tensorflow is imported only when used
+    from policyValueNet import ValueNet
+    return ValueNet(width, height, model_path, inference=True, warmup=True)
 
 
 class Human(object):
@@ -53,12 +70,12 @@ def two_human_run():
     game.start_play(h1, h2)
 
 
-def play_with_AI(model_path: str):
+def play_with_AI(model_path: str, backend='tf'):
     # assert os.path.exists(model_path), 'Invalid model path!'
     width, height = 8, 8
     board = Board(width, height)
     game = Game(board)
-    policy_val_net = ValueNet(width, height, model_path)
+    policy_val_net = load_net(model_path, backend, width, height)
     # AI
     mcts_player_AI = mcts.AI_MCTS_Player(policy_val_fun=policy_val_net.policy_value_fn, c=4)
     # Human
@@ -68,7 +85,26 @@ def play_with_AI(model_path: str):
 
 
 class PlayOnline(object):
-    def __init__(self):
+    # difficulty: search budget of the AI per move
+    LEVELS = {
+        'easy': {'time_ms': None, 'nodes': 50, 'early_stop': True},
+        'normal': {'time_ms': 1000, 'nodes': None, 'early_stop': True},
+        'hard': {'time_ms': 5000, 'nodes': None, 'early_stop': True},
+    }
+    # most empty points solved exactly at each level, within its time_ms
+    ENDGAME = {'easy': 0, 'normal': 12, 'hard': 14}
+
+    def __init__(self, ponder=False, level='normal', batch_size=1, book=None, endgame=None,
+                 endgame_table=None):
+        """
+        ponder: let the AI search on while the human thinks
+        level: difficulty, one of LEVELS
+        batch_size: leaves evaluated per network call by the AI
+        book: opening Book of the AI, see book.py
+        endgame: most empty points from which the AI solves the game exactly
+        (see endgame.py), lowered by the level (ENDGAME), None to search to the end
+        endgame_table: transposition table of the solver shared with other games
+        """
         self.width = 8
         self.height = 8
         # return obj
@@ -80,17 +116,70 @@ class PlayOnline(object):
         self.board = None
         self.game = None
         self.mcts_player_AI = None
-
-    def init(self, model_path):
-        self.policy_val_net = ValueNet(self.width, self.height, model_path)
+        # pondering
+        self.ponder = ponder
+        self.ponder_thread = None
+        self.ponder_stop = None
+        assert level in self.LEVELS, 'Invalid level!'
+        self.level = level
+        self.batch_size = batch_size
+        self.book = book
+        self.endgame = endgame
+        self.endgame_table = endgame_table
+
+    def init(self, model_path, net=None, backend='tf'):
+        """
+        net: network to use instead of loading model_path, e.g. a shared one
+        backend: of the network loaded from model_path, see load_net
+        """
+        self.policy_val_net = net or load_net(model_path, backend, self.width, self.height)
         self.board = Board(self.width, self.height)
         self.game = Game(self.board)
         self.mcts_player_AI = mcts.AI_MCTS_Player(
-            policy_val_fun=self.policy_val_net.policy_value_fn, c=4)
+            policy_val_fun=self.policy_val_net.policy_value_fn, c=4,
+            batch_size=self.batch_size, policy_val_batch=self.policy_val_net.policy_value,
+            book=self.book, solver=None if self.endgame is None else Solver(table=self.endgame_table),
+            **self.LEVELS[self.level])
+        self.m_set_endgame()
         self.board.init_board(0)
 
-    def reset(self):
+    def m_set_endgame(self):
+        """ what the solver may do at the current level """
+        solver = self.mcts_player_AI.m_solver
+        if solver is not None:
+            solver.empties = min(self.endgame, self.ENDGAME[self.level])
+            solver.time_ms = self.LEVELS[self.level]['time_ms']
+
+    def set_level(self, level: str):
+        """ change the difficulty, from the next AI move on """
+        assert level in self.LEVELS, 'Invalid level!'
+        self.level = level
+        self.mcts_player_AI.set_budget(**self.LEVELS[level])
+        self.m_set_endgame()
+
+    def reset(self, level=None):
+        self.stop_ponder()
         self.board.init_board(0)
+        self.mcts_player_AI.reset()
+        if level is not None:
+            self.set_level(level)
+
+    def start_ponder(self):
+        """ search the current position in the background until stop_ponder """
+        if not self.ponder or self.ponder_thread is not None:
+            return
+        self.ponder_stop = threading.Event()
+        self.ponder_thread = threading.Thread(target=self.mcts_player_AI.mcts.ponder,
+                                              args=(copy.deepcopy(self.board), self.ponder_stop),
+                                              daemon=True)
+        self.ponder_thread.start()
+
+    def stop_ponder(self):
+        """ stop the background search, the tree is then ours again """
+        if self.ponder_thread is not None:
+            self.ponder_stop.set()
+            self.ponder_thread.join()
+            self.ponder_thread = None
 
     def two_human_play_online(self, point: int, role: int):
         self.has_error = False
@@ -113,14 +202,18 @@ class PlayOnline(object):
                 "who_win": self.who_win,
                 "turn": self.board.current_player}
 
-    def AI_play_online(self, point: int, role: int):
+    def AI_play_online(self, point: int, role: int, progress=None):
+        """ progress: called with the state of the AI search, see AI_MCTS.report """
         self.has_error = False
+        self.stop_ponder()
         # Human black piece
         if role == 1:
             self.board.draw(point)
+            # keep only the subtree of the human move
+            self.mcts_player_AI.mcts.sync(self.board)
         # AI write piece
         elif role == -1:
-            point = self.mcts_player_AI.action(self.board)
+            point = self.mcts_player_AI.action(self.board, progress=progress)
             self.board.draw(point)
         else:
             self.has_error = True
@@ -132,6 +225,9 @@ class PlayOnline(object):
                     "turn": None,
                     "point": None}
         self.is_end, self.who_win = self.board.game_end()
+        if role == -1 and not self.is_end and self.board.current_player == 1:
+            # the human thinks now
+            self.start_ponder()
         return {"error": self.has_error,
                 "board": self.board.status.flatten().tolist(),
                 "available": self.board.available,
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+matches between players on a process pool, with
+win / draw / loss, Elo difference with its confidence interval
+and SPRT to stop as soon as the result is clear
+python arena.py
+
+a player is given by a spec (a dict, so it can be sent to the workers):
+  {'type': 'mcts', 'playout': 400}                  pure MCTS, MCTS_Player
+  {'type': 'net', 'model': path, 'playout': 200}    network, AI_MCTS_Player
+optional keys: 'c', 'name', 'backend' ('tf', 'numpy', see Human.load_net, or 'float16' / 'int8',
+see quantize.py, int8 calibrated on the self-play positions at 'data_dir' if given,
+or with the saved activation scales at 'scales'),
+'book' (path of an opening book, see book.py), 'endgame' (empty points solved exactly, see endgame.py)
+"""
+import math
+import random
+from concurrent.futures import as_completed
+
+import numpy as np
+
+from board import Board
+from book import Book
+from endgame import Solver
+from Human import load_net
+from mcts import AI_MCTS_Player, MCTS_Player
+from spawn import spawn_executor
+
+# networks loaded in a worker process, by (model path, backend, data_dir, scales), and books by path
+_worker = {}
+
+
+def spec_name(spec):
+    if 'name' in spec:
+        return spec['name']
+    if spec['type'] == 'mcts':
+        return 'mcts_{}'.format(spec['playout'])
+    name = '{}@{}'.format(spec['model'].rstrip('/').split('/')[-1], spec.get('playout', 200))
+    if spec.get('backend', 'tf') != 'tf':
+        name += '/' + spec['backend']
+    if 'book' in spec:
+        name += '+book'
+    if 'endgame' in spec:
+        name += '+eg{}'.format(spec['endgame'])
+    return name
+
+
+def load_spec_net(spec):
+    """ the network of a net spec """
+    backend = spec.get('backend', 'tf')
+    if backend in ('float16', 'int8'):
+        from quantize import QuantizedNet
+        return QuantizedNet(model=spec['model'], mode=backend, data_dir=spec.get('data_dir'),
+                            scales=spec.get('scales'))
+    return load_net(spec['model'], backend)
+
+
+def make_player(spec):
+    """ build the player of spec, the network of a model is loaded once per process """
+    book = None
+    if 'book' in spec:
+        book = _worker.get(spec['book'])
+        if book is None:
+            book = _worker[spec['book']] = Book(spec['book'])
+    solver = Solver(spec['endgame']) if 'endgame' in spec else None
+    if spec['type'] == 'mcts':
+        return MCTS_Player(spec.get('c', 5), spec['playout'], book=book, solver=solver)
+    if spec['type'] == 'net':
+        key = (spec['model'], spec.get('backend', 'tf'), spec.get('data_dir'), spec.get('scales'))
+        net = _worker.get(key)
+        if net is None:
+            net = _worker[key] = load_spec_net(spec)
+        # playout is the budget of every move, not only the first
+        return AI_MCTS_Player(net.policy_value_fn, spec.get('c', 4), nodes=spec.get('playout', 200),
+                              book=book, solver=solver)
+    raise ValueError('unknown player type {}'.format(spec['type']))
+
+
+def play_game(args):
+    """
+    play one game in a worker process
+    args: (spec_a, spec_b, a_first, seed, opening), opening: random plies played
+    first (the same for a given seed) so the games are not all the same
+    return the score of a: 1 win, 0.5 draw, 0 loss
+    """
+    spec_a, spec_b, a_first, seed, opening = args
+    rng = random.Random(seed)
+    np.random.seed(seed)
+    b = Board()
+    b.init_board(0)
+    for i in range(opening):
+        if not b.available:
+            break
+        b.draw(rng.choice(b.available))
+        if b.game_end()[0]:
+            break
+    player_a, player_b = make_player(spec_a), make_player(spec_b)
+    # the one moving next is the first player
+    first = b.get_current_player()
+    second = b.role[1] if first == b.role[0] else b.role[0]
+    players = {first: player_a, second: player_b} if a_first else {first: player_b, second: player_a}
+    for p, player in players.items():
+        player.set_index(p)
+    end, winner = b.game_end()
+    while not end:
+        b.draw(players[b.get_current_player()].action(b))
+        end, winner = b.game_end()
+    if winner == -1:
+        return 0.5
+    return 1.0 if players[winner] is player_a else 0.0
+
+
+def expected_score(elo):
+    return 1.0 / (1.0 + 10.0 ** (-elo / 400.0))
+
+
+def elo_of(score):
+    score = min(max(score, 1e-6), 1.0 - 1e-6)
+    return -400.0 * math.log10(1.0 / score - 1.0)
+
+
+class MatchResult(object):
+    """ wins, draws and losses of a against b, and what follows from them """
+
+    def __init__(self, name_a, name_b):
+        self.name_a = name_a
+        self.name_b = name_b
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        # None, 'H0' (a is not elo1 better) or 'H1' (a is elo1 better)
+        self.sprt = None
+
+    def add(self, score):
+        if score == 1.0:
+            self.wins += 1
+        elif score == 0.0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def score(self):
+        return (self.wins + 0.5 * self.draws) / self.games if self.games else 0.5
+
+    def variance(self):
+        """ variance of the score of one game """
+        if not self.games:
+            return 0.25
+        s = self.score()
+        return (self.wins * (1 - s) ** 2 + self.draws * (0.5 - s) ** 2 + self.losses * s ** 2) / self.games
+
+    def elo(self, z=1.96):
+        """ Elo difference of a over b and its confidence interval (z = 1.96 for 95 %) """
+        s = self.score()
+        margin = z * math.sqrt(self.variance() / max(self.games, 1))
+        return elo_of(s), elo_of(s - margin), elo_of(s + margin)
+
+    def llr(self, elo0, elo1):
+        """ log likelihood ratio of H1 (elo1) against H0 (elo0), normal approximation """
+        var = self.variance()
+        if not self.games or var == 0:
+            return 0.0
+        s0, s1 = expected_score(elo0), expected_score(elo1)
+        return self.games * (s1 - s0) * (2 * self.score() - s0 - s1) / (2 * var)
+
+    def __str__(self):
+        elo, low, high = self.elo()
+        res = '{} vs {}: +{} ={} -{} ({} games), score {:.3f}, elo {:+.1f} [{:+.1f}, {:+.1f}]'.format(
+            self.name_a, self.name_b, self.wins, self.draws, self.losses, self.games,
+            self.score(), elo, low, high)
+        if self.sprt:
+            res += ', SPRT {}'.format(self.sprt)
+        return res
+
+
+class Arena(object):
+    """ plays matches on a pool of worker processes """
+
+    def __init__(self, workers=4, opening=4):
+        """
+        workers: number of processes, games are played in parallel
+        opening: random plies at the start of each pair of games
+        """
+        self.workers = workers
+        self.opening = opening
+        self.m_executor = None
+
+    def m_pool(self):
+        if self.m_executor is None:
+            self.m_executor = spawn_executor(self.workers)
+        return self.m_executor
+
+    def match(self, spec_a, spec_b, games=400, sprt=None, seed=0, verbose=False):
+        """
+        play up to games games of a against b, each opening once with each
+        player moving first
+        sprt: (elo0, elo1, alpha, beta), stop as soon as the test accepts
+        H0 (a is elo0 better than b) or H1 (elo1 better), e.g. (0, 30, 0.05, 0.05)
+        return MatchResult
+        """
+        result = MatchResult(spec_name(spec_a), spec_name(spec_b))
+        if sprt is not None:
+            elo0, elo1, alpha, beta = sprt
+            lower, upper = math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+        pool = self.m_pool()
+        futures = [pool.submit(play_game, (spec_a, spec_b, i % 2 == 0, seed + i // 2, self.opening))
+                   for i in range(games)]
+        try:
+            for future in as_completed(futures):
+                result.add(future.result())
+                if verbose:
+                    print(result)
+                if sprt is not None:
+                    llr = result.llr(elo0, elo1)
+                    if llr <= lower or llr >= upper:
+                        result.sprt = 'H1' if llr >= upper else 'H0'
+                        break
+        finally:
+            # the games not started yet are not needed
+            for future in futures:
+                future.cancel()
+        return result
+
+    def tournament(self, specs, games=100, seed=0):
+        """ every player against every other one, return the MatchResults """
+        return [self.match(specs[i], specs[j], games, seed=seed)
+                for i in range(len(specs)) for j in range(i + 1, len(specs))]
+
+    def gate(self, candidate, best, games=400, elo1=30, alpha=0.05, beta=0.05, verbose=False):
+        """
+        True if the candidate checkpoint is better than best, decided by SPRT
+        verbose: print the result after every game, see match
+        """
+        result = self.match({'type': 'net', 'model': candidate}, {'type': 'net', 'model': best},
+                            games, sprt=(0, elo1, alpha, beta), verbose=verbose)
+        if result.sprt is None:
+            return result.elo()[1] > 0
+        return result.sprt == 'H1'
+
+    def close(self):
+        if self.m_executor is not None:
+            # match cancels the games it does not need, wait for the running ones
+            self.m_executor.shutdown()
+            self.m_executor = None
+
+
+if __name__ == '__main__':
+    arena = Arena()
+    try:
+        for res in arena.tournament([{'type': 'net', 'model': './model/best_94_policy_model'},
+                                     {'type': 'mcts', 'playout': 100},
+                                     {'type': 'mcts', 'playout': 400}], games=40):
+            print(res)
+    finally:
+        arena.close()
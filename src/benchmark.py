@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+micro benchmark of the search hot path
+python benchmark.py
+"""
+import copy
+import time
+import tracemalloc
+
+import numpy as np
+
+from board import Board
+from mcts import MCTS, policy_val_fn, undo_playout
+from numpyNet import NumpyNet
+
+
+def bench_rollout(seconds=3.0):
+    """ random rollouts per second from the initial position """
+    b = Board()
+    b.init_board()
+    mcts = MCTS(policy_val_fn)
+    n, path = 0, []
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        player = b.get_current_player()
+        mcts.m_eval_rollout(b, path)
+        undo_playout(b, path, player)
+        n += 1
+    return n / (time.perf_counter() - start)
+
+
+def playout_peak(playout, n_measure=100):
+    """ median over n_measure calls of the bytes playout allocated at its peak """
+    peaks = []
+    for n in range(n_measure):
+        # tracing from the playout start, the peak is what the playout allocated
+        tracemalloc.start()
+        playout()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return float(np.median(peaks))
+
+
+def bench_playout(n_play=2000):
+    """
+    playouts per second of MCTS.get_move, bytes allocated at the peak of a
+    playout on the warm tree, and the same for a playout on a deepcopy of the
+    board, the old way
+    """
+    b = Board()
+    b.init_board()
+    mcts = MCTS(policy_val_fn, n_play=n_play)
+    start = time.perf_counter()
+    mcts.get_move(b)
+    speed = n_play / (time.perf_counter() - start)
+    return (speed, playout_peak(lambda: mcts.m_playout(b)),
+            playout_peak(lambda: mcts.m_playout(copy.deepcopy(b))))
+
+
+def bench_numpy_net(model='./model/best_94_policy_model', batch_size=1, seconds=2.0):
+    """ start time of NumpyNet and its seconds per batch of batch_size states """
+    start = time.perf_counter()
+    net = NumpyNet(model=model)
+    load = time.perf_counter() - start
+    b = Board()
+    b.init_board()
+    states = np.repeat(b.current_state()[None], batch_size, axis=0)
+    n = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        net.policy_value(states)
+        n += 1
+    return load, (time.perf_counter() - start) / n
+
+
+def bench_copy(n=2000):
+    """ seconds and bytes of one copy.deepcopy(board), the old per-playout cost """
+    b = Board()
+    b.init_board()
+    start = time.perf_counter()
+    for i in range(n):
+        copy.deepcopy(b)
+    cost = (time.perf_counter() - start) / n
+    tracemalloc.start()
+    b_copy = copy.deepcopy(b)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del b_copy
+    return cost, size
+
+
+if __name__ == '__main__':
+    print('rollout: {:.1f} games/s'.format(bench_rollout()))
+    speed, peak, peak_copy = bench_playout()
+    print('playout: {:.1f} playouts/s, peak allocation {:.0f} bytes, {:.0f} bytes on a deepcopy'.format(
+        speed, peak, peak_copy))
+    cost, size = bench_copy()
+    print('deepcopy(board): {:.1f} us, {} bytes'.format(cost * 1e6, size))
+    for bs in (1, 8, 64):
+        load, cost = bench_numpy_net(batch_size=bs)
+        print('numpy net: load {:.1f} ms, batch {}: {:.2f} ms'.format(load * 1e3, bs, cost * 1e3))
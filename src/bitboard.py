@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Bitboard primitives for the 8 * 8 Reversi board
+
+A position is stored as two 64-bit masks (one per player).
+Bit i of a mask is the point i of the board, see
+Board.point_to_location for the numbering.
+"""
+import random
+
+FULL = 0xFFFFFFFFFFFFFFFF
+# column 0 (a-file) and column 7 (h-file)
+COL_0 = 0x0101010101010101
+COL_7 = 0x8080808080808080
+NOT_COL_0 = FULL ^ COL_0
+NOT_COL_7 = FULL ^ COL_7
+INNER = NOT_COL_0 & NOT_COL_7
+
+# (shift, mask applied after shifting), shift > 0 means towards higher points
+DIRECTIONS = (
+    (1, NOT_COL_0),    # (0, 1)
+    (-1, NOT_COL_7),   # (0, -1)
+    (8, FULL),         # (1, 0)
+    (-8, FULL),        # (-1, 0)
+    (9, NOT_COL_0),    # (1, 1)
+    (-9, NOT_COL_7),   # (-1, -1)
+    (7, NOT_COL_7),    # (1, -1)
+    (-7, NOT_COL_0),   # (-1, 1)
+)
+
+
+def shift(b: int, s: int, mask: int):
+    """ shift the mask by s points and drop the pieces wrapping around the board """
+    if s > 0:
+        return (b << s) & mask & FULL
+    return (b >> -s) & mask
+
+
+def legal_moves(own: int, opp: int):
+    """ return the mask of points where own can play """
+    # opponent pieces which are not on column 0 or 7, so a horizontal
+    # or diagonal run can not wrap around the board
+    inner = opp & INNER
+    moves = 0
+    for d, m in ((1, inner), (8, opp), (9, inner), (7, inner)):
+        # towards higher points: run of opponent pieces next to own pieces,
+        # at most 6 opponent pieces in a line
+        pre = m & (m << d)
+        t = m & (own << d)
+        t |= m & (t << d)
+        t |= pre & (t << d + d)
+        t |= pre & (t << d + d)
+        moves |= t << d
+        # towards lower points
+        pre = m & (m >> d)
+        t = m & (own >> d)
+        t |= m & (t >> d)
+        t |= pre & (t >> d + d)
+        t |= pre & (t >> d + d)
+        moves |= t >> d
+    return moves & ~(own | opp) & FULL
+
+
+def flips(own: int, opp: int, point: int):
+    """ return the mask of opponent pieces eaten when own plays at point """
+    flipped = 0
+    move = 1 << point
+    for s, mask in DIRECTIONS:
+        line = 0
+        x = shift(move, s, mask)
+        while x & opp:
+            line |= x
+            x = shift(x, s, mask)
+        if x & own:
+            flipped |= line
+    return flipped
+
+
+def count(b: int):
+    """ number of pieces in the mask """
+    return bin(b).count('1')
+
+
+def points(b: int):
+    """ list of points set in the mask, in increasing order """
+    res = []
+    while b:
+        low = b & -b
+        res.append(low.bit_length() - 1)
+        b ^= low
+    return res
+
+
+# Zobrist keys of a piece of the first / second player at each point,
+# fixed seed so the keys are the same in every process
+_rand = random.Random(20220301)
+ZOBRIST = ([_rand.getrandbits(64) for _ in range(64)],
+           [_rand.getrandbits(64) for _ in range(64)])
+# a piece changing its colour at each point
+ZOBRIST_FLIP = [a ^ b for a, b in zip(*ZOBRIST)]
+del _rand
+
+
+def zobrist(first: int, second: int):
+    """ Zobrist hash of the pieces of the first and second player """
+    h = 0
+    for p in points(first):
+        h ^= ZOBRIST[0][p]
+    for p in points(second):
+        h ^= ZOBRIST[1][p]
+    return h
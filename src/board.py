@@ -7,8 +7,7 @@ If you have any question, pls contact me
 at djh113@126.com
 """
 import numpy as np
-from collections import Counter
-from itertools import chain
+import bitboard
 
 EMPTY = 0
 BLACK = 1
@@ -22,32 +21,64 @@ class Board(object):
         self.width = width
         self.height = height
         assert width == height, 'Invalid Board'
+        assert width * height == 64, 'Bitboard needs 8 * 8 board'
         # role of two player
         self.role = [BLACK, WHITE]
         self.current_player = BLACK
-        # board status
-        self.status = None
-        # other init
-        self.available = list()
-        self.last_board = None
+        # bitboard of each player
+        self.pieces = {BLACK: 0, WHITE: 0}
+        # Zobrist hash of the pieces, kept up to date by draw and undo
+        self.zobrist = 0
+        # points played since init_board
+        self.moves = []
+        # legal moves of current player, and whom it was generated for
+        self.legal = 0
+        self._legal_player = None
+        # cache of status, available and state, rebuilt from bitboard on demand
+        self._status = None
+        self._available = None
+        self._state = None
 
     def init_board(self, start_player=0):
         self.current_player = self.role[start_player]
-        # available localtion
-        # self.available = [19, 26, 37, 44]
-        # init status
-        self.status = np.zeros(self.width * self.height, int)
-        self.status = np.array(self.status).reshape(self.width, self.height)
         # place the piece
-        self.status[3][4], self.status[4][3] = BLACK, BLACK
-        self.status[3][3], self.status[4][4] = WHITE, WHITE
-        # option
-        self.status[3][2] = OPTION
-        self.status[5][4] = OPTION
-        self.status[4][5] = OPTION
-        self.status[2][3] = OPTION
+        # 27(WHITE) 28(BLACK)
+        # 35(BLACK) 36(WHITE)
+        self.pieces = {BLACK: (1 << 28) | (1 << 35),
+                       WHITE: (1 << 27) | (1 << 36)}
+        self.zobrist = bitboard.zobrist(self.pieces[BLACK], self.pieces[WHITE])
+        self.moves = []
+        self._legal_player = None
         self.can_play()
-        self.last_board = self.status
+
+    @property
+    def status(self):
+        """
+        width * height array of EMPTY, BLACK, WHITE and OPTION,
+        OPTION marks the available location of current player
+        """
+        if self._status is None:
+            if not (self.pieces[BLACK] | self.pieces[WHITE]):
+                return None
+            status = np.zeros(self.width * self.height, int)
+            status[bitboard.points(self.pieces[BLACK])] = BLACK
+            status[bitboard.points(self.pieces[WHITE])] = WHITE
+            status[bitboard.points(self.legal)] = OPTION
+            self._status = status.reshape(self.width, self.height)
+        return self._status
+
+    @property
+    def available(self):
+        """ available location of current player """
+        if self._available is None:
+            self._available = bitboard.points(self.legal)
+        return self._available
+
+    def _changed(self):
+        """ drop caches which depend on the bitboard """
+        self._status = None
+        self._available = None
+        self._state = None
 
     def point_to_location(self, point: int):
         """
@@ -81,114 +112,94 @@ class Board(object):
             return -1
         return h * self.width + w
 
-    def current_state(self):
+    def current_state(self, out=None):
         """
         state shape : 4 * w * h
-        :return: state of current player
+        plane 0: pieces of current player, plane 1: pieces of opponent
+        plane 2: available location, plane 3: all 1.0 if current player is black
+        out: optional float32 buffer of shape 4 * w * h to write into
+        :return: state of current player, read-only and cached until next move
         """
-        features = np.zeros((4, self.width, self.height))
-        opponent = self.role[0] if self.current_player == self.role[1] else self.role[1]
-
-        for i in range(self.height):
-            for j in range(self.width):
-                if self.status[i][j] == self.current_player:
-                    features[0][i][j] = 1.0
-                elif self.status[i][j] == opponent:
-                    features[1][i][j] = 1.0
-                elif self.status[i][j] == OPTION:
-                    features[2][i][j] = 1.0
-
+        if out is None and self._state is not None:
+            return self._state
+        features = np.empty((4, self.width, self.height), np.float32) if out is None else out
+        planes = np.array([self.pieces[self.current_player],
+                           self.pieces[self.opponent()],
+                           self.legal], dtype='<u8')
+        features[:3] = np.unpackbits(planes.view(np.uint8), bitorder='little').reshape(
+            3, self.width, self.height)
         # who is current player
-        if self.current_player == self.role[0]:
-            features[3][:, :] = 1.0
+        features[3] = 1.0 if self.current_player == self.role[0] else 0.0
+        if out is None:
+            features.flags.writeable = False
+            self._state = features
         return features
 
-    def judge(self, x: int, y: int, eat_flag=False, grid_num=8):
-        """
-        given position(x, y) and return number of eating opponent piece
-        eat_flag means whether modify the state
-        """
-        direction = [(1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1)]
-        temp_x, temp_y = x, y
-        eat_num = 0
-        if not (self.status[temp_x][temp_y] == EMPTY or self.status[temp_x][temp_y] == OPTION):
-            return 0
-        opponent = self.role[0] if self.current_player == self.role[1] else self.role[1]
-        for i in range(grid_num):
-            # go in some direction
-            temp_x += direction[i][0]
-            temp_y += direction[i][1]
-            if 0 <= temp_x < grid_num and 0 <= temp_y < grid_num \
-                    and self.status[temp_x][temp_y] == opponent:
-                temp_x += direction[i][0]
-                temp_y += direction[i][1]
-                while grid_num > temp_x >= 0 and grid_num > temp_y >= 0:
-                    # empty place, can't take a pawn
-                    if self.status[temp_x][temp_y] == EMPTY or self.status[temp_x][temp_y] == OPTION:
-                        break
-                    # find your own piece
-                    if self.status[temp_x][temp_y] == self.current_player:
-                        if eat_flag:
-                            self.status[x][y] = self.current_player
-                            temp_x -= direction[i][0]
-                            temp_y -= direction[i][1]
-                            while temp_x != x or temp_y != y:
-                                # mark as own
-                                self.status[temp_x][temp_y] = self.current_player
-                                # back up
-                                temp_x -= direction[i][0]
-                                temp_y -= direction[i][1]
-                                # update eat number
-                                eat_num += 1
-                        else:
-                            temp_x -= direction[i][0]
-                            temp_y -= direction[i][1]
-                            while temp_x != x or temp_y != y:
-                                # back up
-                                temp_x -= direction[i][0]
-                                temp_y -= direction[i][1]
-                                # update eat number
-                                eat_num += 1
-                        break
-                    # not find own piece
-                    temp_x += direction[i][0]
-                    temp_y += direction[i][1]
-            # change the direction
-            temp_x, temp_y = x, y
-        return eat_num
-
     def can_play(self):
-        flag = False
-        self.available = []
-        for i in range(8):
-            for j in range(8):
-                if self.status[i][j] == OPTION:
-                    self.status[i][j] = EMPTY
-                if self.judge(i, j) > 0:
-                    self.status[i][j] = OPTION
-                    self.available.append(self.location_to_point([i, j]))
-                    flag = True
-        return flag
+        # the legal moves only change with the pieces or the player
+        if self._legal_player != self.current_player:
+            self.legal = bitboard.legal_moves(self.pieces[self.current_player],
+                                              self.pieces[self.opponent()])
+            self._legal_player = self.current_player
+            self._changed()
+        return self.legal != 0
 
     def draw(self, point):
-        x, y = self.point_to_location(point)
-        self.last_board = self.status
-        self.judge(x, y, True)
+        """
+        place the piece and change the player
+        return the undo record of this move, see undo
+        """
+        # point may be a numpy integer picked by np.random.choice
+        point = int(point)
+        player, legal, legal_player = self.current_player, self.legal, self._legal_player
+        zobrist = self.zobrist
+        own = self.pieces[player]
+        opp = self.pieces[self.opponent()]
+        eaten = bitboard.flips(own, opp, point)
+        if eaten:
+            self.pieces[player] = own | eaten | (1 << point)
+            self.pieces[self.opponent()] = opp ^ eaten
+            self._legal_player = None
+            # update the hash with the new piece and the eaten pieces
+            h = zobrist ^ bitboard.ZOBRIST[player != self.role[0]][point]
+            rest = eaten
+            while rest:
+                low = rest & -rest
+                h ^= bitboard.ZOBRIST_FLIP[low.bit_length() - 1]
+                rest ^= low
+            self.zobrist = h
         # change the player
-        self.current_player = self.role[0] \
-            if self.current_player == self.role[1] else self.role[1]
+        self.current_player = self.opponent()
+        self.can_play()
+        self.moves.append(point)
+        return point, player, legal, legal_player, eaten, zobrist
+
+    def undo(self, record):
+        """
+        take back the move returned by draw, the board and
+        the side to move are restored as before the move
+        records must be undone in the reverse order of draw
+        """
+        point, player, legal, legal_player, eaten, zobrist = record
+        if eaten:
+            opponent = self.role[0] if player == self.role[1] else self.role[1]
+            self.pieces[player] ^= eaten | (1 << point)
+            self.pieces[opponent] |= eaten
+        self.current_player = player
+        self.legal = legal
+        self._legal_player = legal_player
+        self.zobrist = zobrist
+        self.moves.pop()
+        self._changed()
 
     def game_end(self):
         """ check who win the game """
         if not self.can_play():
-            self.current_player = self.role[0] \
-                if self.current_player == self.role[1] else self.role[1]
+            self.current_player = self.opponent()
 
             if not self.can_play():
-                flatten = list(chain.from_iterable(self.status))
-                res = Counter(flatten)
-                black = res[self.role[0]]
-                white = res[self.role[1]]
+                black = bitboard.count(self.pieces[self.role[0]])
+                white = bitboard.count(self.pieces[self.role[1]])
                 if black < white:
                     res = self.role[1]
                 elif black > white:
@@ -204,6 +215,29 @@ class Board(object):
     def get_current_player(self):
         return self.current_player
 
+    def key(self):
+        """ key of the position and the side to move """
+        return self.zobrist, self.current_player
+
+    def opponent(self):
+        return self.role[0] if self.current_player == self.role[1] else self.role[1]
+
+
+def current_states(planes, black, out=None):
+    """
+    current_state of N positions at once, e.g. the ones of a game
+    planes: N * 3 of the (own, opp, legal) bitboards of each position
+    black: N booleans, the current player is black
+    out: optional float32 buffer of shape N * 4 * 8 * 8 to write into
+    """
+    planes = np.asarray(planes, dtype='<u8')
+    n = len(planes)
+    if out is None:
+        out = np.empty((n, 4, 8, 8), np.float32)
+    out[:, :3] = np.unpackbits(planes.view(np.uint8), axis=1, bitorder='little').reshape(n, 3, 8, 8)
+    out[:, 3] = np.asarray(black, np.float32)[:, None, None]
+    return out
+
 
 class Game(object):
     def __init__(self, board: Board):
@@ -261,11 +295,13 @@ class Game(object):
         """
         self.board.init_board()
         p1, p2 = self.board.role
-        states, mcts_p, current = [], [], []
+        # bitboards of the positions, encoded all at once at the end
+        planes, mcts_p, current = [], [], []
         while True:
             point, move_p = player.action(self.board, p, True)
             # store
-            states.append(self.board.current_state())
+            planes.append((self.board.pieces[self.board.current_player],
+                           self.board.pieces[self.board.opponent()], self.board.legal))
             mcts_p.append(move_p)
             current.append(self.board.current_player)
             # go step
@@ -281,5 +317,5 @@ class Game(object):
                     winner_score[np.array(current) != winner] = -1.0
                 # reset
                 player.reset()
-
+                states = current_states(planes, np.array(current) == p1)
                 return winner, zip(states, mcts_p, winner_score)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+opening book: root visit counts of deep searches of the first plies
+the positions are keyed by their canonical symmetric variant (see
+symmetry.canonical), so symmetric openings and transpositions share one
+entry, the moves are stored in the frame of the canonical variant
+on disk a book is one .npy array of RECORD, one row per (position, move)
+python book.py
+"""
+import copy
+
+import numpy as np
+
+from board import Board
+from spawn import spawn_executor
+from symmetry import INVERSE, N_SYMMETRY, PERMS, canonical, transform_bits
+
+RECORD = np.dtype([('own', '<u8'),
+                   ('opp', '<u8'),
+                   ('player', np.uint8),
+                   ('move', np.uint8),
+                   ('visits', '<u4')])
+
+
+def book_key(b: Board):
+    """ ((own, opp, side to move) of the canonical variant, symmetry taking b to it) """
+    own, opp, k = canonical(b.pieces[b.current_player], b.pieces[b.opponent()])
+    return (own, opp, b.current_player), k
+
+
+class Book(object):
+    """ moves and their visit counts by position, read-only once loaded """
+
+    def __init__(self, path=None, temperature=1.0, min_share=0.1):
+        """
+        path: book file to load
+        temperature: book moves are drawn with probability visits ** (1 / temperature),
+        near 0 always plays the most visited move
+        min_share: moves with fewer visits than min_share times the most visited are not played
+        """
+        self.temperature = temperature
+        self.min_share = min_share
+        # key -> (moves, visits)
+        self.m_table = {}
+        if path is not None:
+            self.load(path)
+
+    def add(self, b: Board, acts, visits):
+        """ the search result of position b, acts and visits of its root moves """
+        key, k = book_key(b)
+        acts = INVERSE[k][np.asarray(acts, int)]
+        visits = np.asarray(visits, np.float64)
+        # moves of a symmetric position which are the same by symmetry share their visits,
+        # e.g. the 4 first moves
+        own, opp, _ = key
+        same = [s for s in range(1, N_SYMMETRY)
+                if transform_bits(own, s) == own and transform_bits(opp, s) == opp]
+        if same:
+            total = dict(zip(acts.tolist(), visits))
+            visits = np.array([np.mean([total.get(int(INVERSE[s][a]), 0.0) for s in [0] + same])
+                               for a in acts])
+        self.m_table[key] = (acts.astype(np.uint8), np.rint(visits).astype(np.uint32))
+
+    def moves(self, b: Board):
+        """ (moves, visits) of position b, or None if not in the book """
+        key, k = book_key(b)
+        entry = self.m_table.get(key)
+        if entry is None:
+            return None
+        return PERMS[k][entry[0]], entry[1]
+
+    def move(self, b: Board, rng=np.random):
+        """ a book move for b, drawn by visits, or None if b is not in the book """
+        entry = self.moves(b)
+        if entry is None or not entry[1].any():
+            return None
+        acts, visits = entry
+        visits = visits.astype(np.float64)
+        keep = visits >= self.min_share * visits.max()
+        acts, visits = acts[keep], visits[keep]
+        if self.temperature < 1e-3:
+            return int(acts[int(np.argmax(visits))])
+        p = (visits / visits.max()) ** (1.0 / self.temperature)
+        return int(rng.choice(acts, p=p / p.sum()))
+
+    def save(self, path):
+        records = np.zeros(sum(len(acts) for acts, _ in self.m_table.values()), RECORD)
+        i = 0
+        for (own, opp, player), (acts, visits) in sorted(self.m_table.items()):
+            rows = records[i:i + len(acts)]
+            rows['own'], rows['opp'], rows['player'] = own, opp, player
+            rows['move'], rows['visits'] = acts, visits
+            i += len(acts)
+        np.save(path, records)
+
+    def load(self, path):
+        records = np.load(path)
+        self.m_table = {}
+        if not len(records):
+            return
+        # rows of a position are contiguous
+        keys = np.stack([records['own'], records['opp'], records['player'].astype(np.uint64)])
+        starts = np.flatnonzero(np.r_[True, (keys[:, 1:] != keys[:, :-1]).any(axis=0)])
+        for start, end in zip(starts, np.r_[starts[1:], len(records)]):
+            row = records[start]
+            self.m_table[(int(row['own']), int(row['opp']), int(row['player']))] = (
+                records['move'][start:end].copy(), records['visits'][start:end].copy())
+
+    def __len__(self):
+        return len(self.m_table)
+
+    def __str__(self):
+        return 'Book(positions:{}, moves:{})'.format(
+            len(self), sum(len(acts) for acts, _ in self.m_table.values()))
+
+
+def search(args):
+    """
+    deep search of one position in a worker process
+    args: (spec, board), spec as in arena.py, its playout is the depth
+    return (acts, visits) of the root
+    """
+    from arena import make_player
+    from mcts import AI_MCTS_Player
+    spec, b = args
+    player = make_player(spec)
+    mcts = player.mcts
+    mcts.sync(b)
+    if isinstance(player, AI_MCTS_Player):
+        mcts.get_move_p(b)
+    else:
+        mcts.get_move(b)
+    acts, visits = mcts.m_tree.child_visits(mcts.m_tree.m_root)
+    return acts, visits.tolist()
+
+
+def build(spec, plies=6, min_share=0.2, workers=4, verbose=False):
+    """
+    search every position of the first plies plies reached by book moves
+    spec: the searching player, as in arena.py, e.g.
+    {'type': 'net', 'model': path, 'backend': 'numpy', 'playout': 4000}
+    min_share: the moves followed to the next ply have at least min_share
+    times the visits of the most visited one
+    workers: processes searching positions of the same ply in parallel
+    return the Book
+    """
+    book = Book(min_share=min_share)
+    b = Board()
+    b.init_board(0)
+    frontier = [b]
+    pool = spawn_executor(workers) if workers > 1 else None
+    try:
+        for ply in range(plies):
+            jobs = [(spec, b) for b in frontier]
+            results = pool.map(search, jobs) if pool is not None else map(search, jobs)
+            children = {}
+            for b, (acts, visits) in zip(frontier, results):
+                if not acts:
+                    continue
+                book.add(b, acts, visits)
+                best = max(visits)
+                for act, n in zip(acts, visits):
+                    if n < min_share * best:
+                        continue
+                    child = copy.deepcopy(b)
+                    child.draw(act)
+                    if child.game_end()[0]:
+                        continue
+                    children.setdefault(book_key(child)[0], child)
+            if verbose:
+                print('ply {}: {} positions, {}'.format(ply, len(frontier), book))
+            frontier = list(children.values())
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return book
+
+
+if __name__ == '__main__':
+    opening = build({'type': 'net', 'model': './model/best_94_policy_model', 'backend': 'numpy',
+                     'playout': 4000}, plies=6, verbose=True)
+    opening.save('./model/opening_book.npy')
+    print(opening)
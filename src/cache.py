@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+cache of network evaluations
+"""
+from collections import OrderedDict
+
+from board import Board
+from symmetry import INVERSE, PERMS, canonical
+
+
+class EvalCache(object):
+    """
+    bounded LRU cache of (priors, value) of positions,
+    keyed by Zobrist hash and side to move, see Board.key
+    """
+
+    def __init__(self, policy_value_fn=None, size=100000):
+        """
+        policy_value_fn: evaluation to put the cache in front of,
+        e.g. ValueNet.policy_value_fn
+        size: max number of positions kept
+        """
+        self.m_policy = policy_value_fn
+        self.m_size = size
+        self.m_table = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, b: Board):
+        """ the key of b for lookup and store """
+        return b.key()
+
+    def lookup(self, key):
+        """
+        key: self.key() of the position
+        return cached (list of (action, probability), value) or None
+        """
+        entry = self.m_table.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.m_table.move_to_end(key)
+        return entry
+
+    def store(self, key, action_p, value):
+        """ add the evaluation of position key, return the stored entry """
+        entry = (tuple(action_p), value)
+        self.m_table[key] = entry
+        if len(self.m_table) > self.m_size:
+            # drop the least recently used
+            self.m_table.popitem(last=False)
+        return entry
+
+    def __call__(self, b: Board):
+        """ same as policy_value_fn """
+        key = self.key(b)
+        entry = self.lookup(key)
+        if entry is None:
+            entry = self.store(key, *self.m_policy(b))
+        return entry
+
+    def __len__(self):
+        return len(self.m_table)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        self.m_table.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return type(self).__name__ + '(size:{}/{}, hits:{}, misses:{}, hit rate:{:.3f})'.format(
+            len(self), self.m_size, self.hits, self.misses, self.hit_rate())
+
+
+class SymmetryCache(EvalCache):
+    """
+    EvalCache that stores one entry for the 8 symmetric variants of a
+    position: the key is the canonical variant (see symmetry.canonical),
+    the priors are stored in its frame and mapped back on lookup
+    """
+
+    def key(self, b: Board):
+        """ (canonical pieces and side to move, symmetry taking b to them) """
+        own, opp, k = canonical(b.pieces[b.current_player], b.pieces[b.opponent()])
+        return (own, opp, b.current_player), k
+
+    def lookup(self, key):
+        """
+        key: self.key() of the position
+        return cached (list of (action, probability), value) or None
+        """
+        key, k = key
+        entry = EvalCache.lookup(self, key)
+        if entry is None or not k:
+            return entry
+        back = PERMS[k]
+        return tuple((int(back[a]), p) for a, p in entry[0]), entry[1]
+
+    def store(self, key, action_p, value):
+        """ add the evaluation of position key, return the entry in the frame of the position """
+        key, k = key
+        action_p = tuple(action_p)
+        if not k:
+            return EvalCache.store(self, key, action_p, value)
+        to = INVERSE[k]
+        EvalCache.store(self, key, tuple((int(to[a]), p) for a, p in action_p), value)
+        return action_p, value
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+self-play positions on disk
+a dataset is a directory of append-only shards, each shard is
+  <name>.rec  fixed size records: bit-packed state, outcome, where its policy is
+  <name>.pol  the non zero entries (point, probability) of the policies
+and index.json lists the shards with their number of positions,
+the loader memory-maps the shards, nothing is read before it is sampled
+"""
+import json
+import os
+
+import numpy as np
+
+import symmetry
+
+RECORD = np.dtype([('state', np.uint8, 32),
+                   ('winner', np.int8),
+                   ('p_len', np.uint8),
+                   ('p_start', '<u8')])
+POLICY = np.dtype([('point', np.uint8), ('p', '<f2')])
+INDEX = 'index.json'
+
+
+def read_index(path):
+    """ list of shards {name, positions, entries, games} of the dataset at path """
+    try:
+        with open(os.path.join(path, INDEX)) as f:
+            return json.load(f)['shards']
+    except FileNotFoundError:
+        return []
+
+
+def write_index(path, shards):
+    """ replace index.json at once, a reader sees the old or the new one """
+    tmp = os.path.join(path, INDEX + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump({'shards': shards}, f, indent=1)
+    os.replace(tmp, os.path.join(path, INDEX))
+
+
+class ShardWriter(object):
+    """ appends self-play games to the dataset at path """
+
+    def __init__(self, path, shard_size=1000000):
+        """
+        shard_size: positions per shard, then a new shard is started
+        """
+        self.path = path
+        self.shard_size = shard_size
+        os.makedirs(path, exist_ok=True)
+        self.m_shards = read_index(path)
+        self.m_rec = None
+        self.m_pol = None
+
+    def m_open(self):
+        """ start a new shard, the shards written before are never touched again """
+        name = 'shard-{:05d}'.format(len(self.m_shards))
+        self.m_shards.append({'name': name, 'positions': 0, 'entries': 0, 'games': 0})
+        self.m_rec = open(os.path.join(self.path, name + '.rec'), 'wb')
+        self.m_pol = open(os.path.join(self.path, name + '.pol'), 'wb')
+
+    def add_game(self, play_data):
+        """ play_data: [(state, mcts_p, winner_score)] of one game, see Game.start_self_play """
+        play_data = list(play_data)
+        if not play_data:
+            return
+        if self.m_rec is None or self.m_shards[-1]['positions'] >= self.shard_size:
+            self.close()
+            self.m_open()
+        shard = self.m_shards[-1]
+        states, mcts_p, winners = zip(*play_data)
+        n = len(states)
+        mcts_p = np.asarray(mcts_p).reshape(n, -1)
+        rows, points = np.nonzero(mcts_p)
+        policy = np.empty(len(rows), POLICY)
+        policy['point'] = points
+        policy['p'] = mcts_p[rows, points]
+        records = np.empty(n, RECORD)
+        records['state'] = np.packbits(np.asarray(states).reshape(n, -1) != 0, axis=1)
+        records['winner'] = winners
+        records['p_len'] = np.bincount(rows, minlength=n)
+        records['p_start'] = shard['entries'] + np.concatenate(
+            ([0], np.cumsum(records['p_len'])[:-1]))
+        # policies first, a record never points past the end of the policy file
+        self.m_pol.write(policy.tobytes())
+        self.m_rec.write(records.tobytes())
+        shard['positions'] += n
+        shard['entries'] += len(policy)
+        shard['games'] += 1
+
+    def flush(self):
+        """ make the games written so far visible to the loaders """
+        if self.m_rec is not None:
+            self.m_pol.flush()
+            self.m_rec.flush()
+            write_index(self.path, self.m_shards)
+
+    def close(self):
+        if self.m_rec is not None:
+            self.flush()
+            self.m_rec.close()
+            self.m_pol.close()
+            self.m_rec = None
+            self.m_pol = None
+
+
+class ShardDataset(object):
+    """ random access to the positions of the dataset at path, memory-mapped """
+
+    def __init__(self, path, width=8, height=8):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.m_records = []
+        self.m_policies = []
+        sizes = []
+        for shard in read_index(path):
+            if not shard['positions']:
+                continue
+            name = os.path.join(path, shard['name'])
+            self.m_records.append(np.memmap(name + '.rec', RECORD, 'r', shape=(shard['positions'],)))
+            self.m_policies.append(np.memmap(name + '.pol', POLICY, 'r', shape=(shard['entries'],))
+                                   if shard['entries'] else np.zeros(0, POLICY))
+            sizes.append(shard['positions'])
+        # first global position of each shard
+        self.m_offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+
+    def __len__(self):
+        return int(self.m_offsets[-1])
+
+    def packed(self, index):
+        """ (bit-packed states, dense policies, winners) of the global positions index """
+        index = np.asarray(index, dtype=np.int64)
+        n = len(index)
+        states = np.empty((n, 32), np.uint8)
+        probs = np.zeros((n, self.width * self.height), np.float32)
+        winners = np.empty(n, np.int8)
+        shard = np.searchsorted(self.m_offsets, index, side='right') - 1
+        for s in np.unique(shard):
+            rows = np.flatnonzero(shard == s)
+            # sorted reads are kinder to the page cache
+            local = index[rows] - self.m_offsets[s]
+            order = np.argsort(local)
+            rows, local = rows[order], local[order]
+            rec = self.m_records[s][local]
+            states[rows] = rec['state']
+            winners[rows] = rec['winner']
+            # gather the sparse entries of all the policies at once
+            lens = rec['p_len'].astype(np.int64)
+            owner = np.repeat(rows, lens)
+            start = np.repeat(rec['p_start'].astype(np.int64) - np.cumsum(lens) + lens, lens)
+            entries = self.m_policies[s][start + np.arange(lens.sum())]
+            probs[owner, entries['point']] = entries['p']
+        return states, probs, winners
+
+    def rows(self, index):
+        """ unpacked float32 (states, mcts_p, winners) of the global positions index """
+        states, probs, winners = self.packed(index)
+        states = np.unpackbits(states, axis=1).reshape(
+            len(states), 4, self.width, self.height).astype(np.float32)
+        return states, probs, winners.astype(np.float32)
+
+    def sample(self, n, rng=np.random, augment=False):
+        """ n random positions (with replacement), a random symmetry each if augment """
+        states, probs, winners = self.rows(rng.randint(len(self), size=n))
+        if augment:
+            states, probs = symmetry.random_symmetry(states, probs, rng)
+        return states, probs, winners
+
+    def batches(self, batch_size, rng=np.random, augment=False):
+        """ endless random mini-batches, see sample """
+        while True:
+            yield self.sample(batch_size, rng, augment)
+
+    def fill(self, buffer, n=None):
+        """ add the last n positions (all if None) to a ReplayBuffer, e.g. to warm-start it """
+        n = min(len(self), buffer.size if n is None else n)
+        if n:
+            buffer.add_packed(*self.packed(np.arange(len(self) - n, len(self))))
+        return n
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+exact endgame solver: negamax with alpha-beta pruning on the bitboards,
+moves ordered by the transposition table and by the fewest replies left
+to the opponent (fastest first), the transposition table keeps the
+bounds found for each position
+the score of a position is the final disc difference for the side to
+move, the empty points going to the winner
+python endgame.py
+"""
+import time
+
+from bitboard import count, legal_moves
+from board import Board
+
+CORNERS = (1 << 0) | (1 << 7) | (1 << 56) | (1 << 63)
+# points next to a corner, given away to the opponent if played early
+X_C = 0x42C300000000C342
+
+
+def _rays():
+    """ per point: the masks of the points in each of the 8 directions, nearest first """
+    rays = []
+    for p in range(64):
+        h, w = divmod(p, 8)
+        dirs = []
+        for dh, dw in ((0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (-1, -1), (1, -1), (-1, 1)):
+            ray = []
+            y, x = h + dh, w + dw
+            while 0 <= y < 8 and 0 <= x < 8:
+                ray.append(1 << (y * 8 + x))
+                y, x = y + dh, x + dw
+            if len(ray) > 1:
+                dirs.append(ray)
+        rays.append(dirs)
+    return rays
+
+
+RAYS = _rays()
+
+
+def flips(own: int, opp: int, point: int):
+    """ same as bitboard.flips, walking the rays of point """
+    flipped = 0
+    for ray in RAYS[point]:
+        line = 0
+        for bit in ray:
+            if opp & bit:
+                line |= bit
+            else:
+                if own & bit:
+                    flipped |= line
+                break
+    return flipped
+
+
+class Timeout(Exception):
+    """ the solve went over its time budget """
+
+
+def final_score(own: int, opp: int):
+    """ disc difference of a finished game for own, the empty points go to the winner """
+    n_own, n_opp = count(own), count(opp)
+    if n_own > n_opp:
+        return 64 - 2 * n_opp
+    if n_own < n_opp:
+        return 2 * n_own - 64
+    return 0
+
+
+class Solver(object):
+    """ solves positions with at most empties empty points """
+
+    # positions with fewer empty points are not stored nor ordered
+    TT_EMPTIES = 6
+    ORDER_EMPTIES = 5
+
+    # nodes between two looks at the clock
+    CHECK_NODES = 1024
+
+    def __init__(self, empties=12, exact=False, tt_size=200000, time_ms=None, table=None):
+        """
+        empties: positions with more empty points are left to the search,
+        the solve time grows about 3 to 5 times per empty point: without
+        exact, up to 0.3 s at 12 and up to 2 s at 14, lost positions are the slowest
+        exact: find the exact disc difference, otherwise only win / draw / loss
+        (a null window search, much faster), enough to play perfectly
+        tt_size: positions kept in the transposition table, cleared when full,
+        a solve at 14 empty points stores about 10 ** 4 of them
+        time_ms: give up a solve after that many milliseconds, None for no limit
+        table: transposition table (a dict) shared with other solvers, e.g. by
+        the games of a server, the bounds in it hold whatever the window
+        """
+        self.empties = empties
+        self.exact = exact
+        self.tt_size = tt_size
+        self.time_ms = time_ms
+        # (own, opp) -> (lower bound, upper bound, best move)
+        self.m_own_table = table is None
+        self.m_table = {} if table is None else table
+        self.m_deadline = None
+        self.nodes = 0
+
+    def solve(self, own: int, opp: int):
+        """ (score, best move) of the position, own to move, best move -1 if own has to pass """
+        if len(self.m_table) > self.tt_size:
+            self.m_table.clear()
+        if self.exact:
+            return self.m_root(own, opp, -64, 64)
+        # win / draw / loss: is the score above 0, then below 0
+        score, move = self.m_root(own, opp, -1, 1)
+        return max(-1, min(1, score)), move
+
+    def m_root(self, own, opp, alpha, beta):
+        moves = legal_moves(own, opp)
+        if not moves:
+            if not legal_moves(opp, own):
+                return final_score(own, opp), -1
+            return -self.m_search(opp, own, -beta, -alpha, 64 - count(own | opp)), -1
+        best, best_move = -65, -1
+        for point, o, p in self.m_children(own, opp, moves, 64 - count(own | opp)):
+            score = -self.m_search(p, o, -beta, -max(alpha, best), 64 - count(o | p))
+            if score > best:
+                best, best_move = score, point
+                if best >= beta:
+                    break
+        return best, best_move
+
+    def m_children(self, own, opp, moves, empties, first=-1):
+        """ (point, own after, opp after) of the moves, best first """
+        children = []
+        while moves:
+            low = moves & -moves
+            moves ^= low
+            point = low.bit_length() - 1
+            eaten = flips(own, opp, point)
+            children.append((point, own | eaten | low, opp ^ eaten))
+        if empties > self.ORDER_EMPTIES and len(children) > 1:
+            def order(child):
+                point, o, p = child
+                if point == first:
+                    return -100
+                # fewest replies, corners first, next to a corner last
+                return (4 * count(legal_moves(p, o)) - 8 * (CORNERS >> point & 1) +
+                        4 * (X_C >> point & 1))
+
+            children.sort(key=order)
+        return children
+
+    def m_search(self, own, opp, alpha, beta, empties):
+        """ negamax score of the position for own in the window (alpha, beta), fail soft """
+        self.nodes += 1
+        if self.m_deadline is not None and not self.nodes % self.CHECK_NODES and time.time() > self.m_deadline:
+            raise Timeout()
+        if empties == 0:
+            return final_score(own, opp)
+        moves = legal_moves(own, opp)
+        if not moves:
+            if not legal_moves(opp, own):
+                return final_score(own, opp)
+            return -self.m_search(opp, own, -beta, -alpha, empties)
+        if empties == 1:
+            # the last move, no need to order nor store
+            point = moves.bit_length() - 1
+            eaten = flips(own, opp, point)
+            return final_score(own | eaten | (1 << point), opp ^ eaten)
+        first = -1
+        if empties >= self.TT_EMPTIES:
+            entry = self.m_table.get((own, opp))
+            if entry is not None:
+                lower, upper, first = entry
+                if lower >= beta:
+                    return lower
+                if upper <= alpha:
+                    return upper
+                alpha, beta = max(alpha, lower), min(beta, upper)
+        a = alpha
+        best, best_move = -65, -1
+        for point, o, p in self.m_children(own, opp, moves, empties, first):
+            score = -self.m_search(p, o, -beta, -max(a, best), empties - 1)
+            if score > best:
+                best, best_move = score, point
+                if best >= beta:
+                    break
+        if empties >= self.TT_EMPTIES:
+            lower, upper = -64, 64
+            entry = self.m_table.get((own, opp))
+            if entry is not None:
+                lower, upper = entry[0], entry[1]
+            if best <= alpha:
+                upper = min(upper, best)
+            elif best >= beta:
+                lower = max(lower, best)
+            else:
+                lower = upper = best
+            self.m_table[(own, opp)] = (lower, upper, best_move)
+        return best
+
+    def move(self, b: Board):
+        """
+        (best move, score for the side to move) of b if it has at most
+        empties empty points and a legal move, None otherwise
+        or if the solve did not finish within time_ms
+        """
+        own, opp = b.pieces[b.current_player], b.pieces[b.opponent()]
+        if 64 - count(own | opp) > self.empties or not b.available:
+            return None
+        if self.time_ms is not None:
+            self.m_deadline = time.time() + self.time_ms / 1000.0
+        try:
+            score, move = self.solve(own, opp)
+        except Timeout:
+            # what was solved stays in the table for the next move
+            return None
+        finally:
+            self.m_deadline = None
+        return move, score
+
+    def clear(self):
+        """ start a new game, a shared table is left to its other solvers """
+        if self.m_own_table:
+            self.m_table.clear()
+        self.nodes = 0
+
+
+if __name__ == '__main__':
+    import random
+    rng = random.Random(0)
+    for empties in (10, 12, 14):
+        for exact in (False, True):
+            solver = Solver(empties, exact)
+            total = 0.0
+            for game in range(5):
+                b = Board()
+                b.init_board(0)
+                while not b.game_end()[0] and 64 - count(b.pieces[b.role[0]] | b.pieces[b.role[1]]) > empties:
+                    b.draw(rng.choice(b.available))
+                if b.game_end()[0]:
+                    continue
+                start = time.time()
+                solver.clear()
+                move, score = solver.move(b)
+                total += time.time() - start
+                print('empties {} exact {}: move {} score {} nodes {} {:.2f}s'.format(
+                    empties, exact, move, score, solver.nodes, time.time() - start))
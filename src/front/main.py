@@ -1,9 +1,20 @@
-from flask import Flask, render_template, request, jsonify
-from Human import PlayOnline
+import json
+import os
+
+from flask import Flask, Response, render_template, request, jsonify
+from book import Book
+from Human import PlayOnline, load_net
+from session import SessionManager
 
 
 app = Flask(__name__)
-player = PlayOnline()
+# one board and search tree per game, one network for all of them
+sessions = None
+
+
+def get_level():
+    level = request.args.get('level')
+    return level if level in PlayOnline.LEVELS else None
 
 
 @app.route('/')
@@ -14,16 +25,70 @@ def index():
 @app.route('/player/<string:id>')
 def goChess(id):
     point = request.args['point']
-    res = player.AI_play_online(int(point), int(id))
+    res = sessions.play(request.args.get('game'), int(point), int(id))
+    if res is None:
+        return jsonify({"error": True, "message": "unknown game"}), 404
     return jsonify(res)
 
 
+@app.route('/async/player/<string:id>')
+def goChessAsync(id):
+    """ start the move, return the job id to follow it at once """
+    point = request.args['point']
+    job = sessions.submit(request.args.get('game'), int(point), int(id))
+    if job is None:
+        return jsonify({"error": True, "message": "unknown game"}), 404
+    return jsonify({"job": job.job_id})
+
+
+@app.route('/job/<string:job_id>')
+def pollJob(job_id):
+    """ long poll, answer once the job changed after version since, or is done """
+    job = sessions.job(job_id)
+    if job is None:
+        return jsonify({"error": True, "message": "unknown job"}), 404
+    since = int(request.args.get('since', -1))
+    timeout = min(float(request.args.get('timeout', 10)), 30)
+    return jsonify(job.wait(since, timeout))
+
+
+@app.route('/job/<string:job_id>/stream')
+def streamJob(job_id):
+    """ Server-Sent Events, one event per change of the job until it is done """
+    job = sessions.job(job_id)
+    if job is None:
+        return jsonify({"error": True, "message": "unknown job"}), 404
+
+    def events():
+        since = -1
+        while True:
+            snapshot = job.wait(since, 15)
+            if snapshot['version'] == since:
+                # keep the connection alive
+                yield ': ping\n\n'
+                continue
+            since = snapshot['version']
+            yield 'data: {}\n\n'.format(json.dumps(snapshot))
+            if snapshot['state'] in ('done', 'error'):
+                return
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+
 @app.route('/restart')
 def restart():
-    player.reset()
-    return render_template('index.html')
+    game_id = sessions.restart(request.args.get('game'), get_level())
+    return jsonify({"game": game_id})
 
 
 if __name__ == '__main__':
-    player.init('../model/best_94_policy_model')
-    app.run(host='127.0.0.1', port=8877, debug=True)
+    # the numpy backend starts at once and is faster on small batches
+    # opening moves from the book built by book.py, if there is one
+    # the games search on while their human thinks (ponder), until their tree is full
+    book_path = '../model/opening_book.npy'
+    sessions = SessionManager(load_net('../model/best_94_policy_model', 'numpy'),
+                              ponder=True,
+                              book=Book(book_path) if os.path.exists(book_path) else None,
+                              endgame=14)
+    app.run(host='127.0.0.1', port=8877, debug=True, threaded=True)
@@ -67,6 +67,8 @@ function Chessboard(){
 function Othello(){
     var oo = this;
     var map = [];
+    // id of our game on the server
+    oo.game = null;
     var pass_obj = document.getElementById("pass");
 
     oo.play = function(){
@@ -91,62 +93,99 @@ function Othello(){
         board.update(map);
     }
 
+    // show the board after a move
+    function onMove(res){
+		if(res.error == true){
+			alert("error!");
+			return;
+		}
+		map.black = 0;
+		map.white = 0;
+		map.newRev = [];
+		for(var i = 0; i < 64; i++){
+			if(res.board[i] == 1) {
+				if(map[i] == -1) map.newRev.push(i);
+				map[i] = 1;
+				map.black++;
+			}
+			else if(res.board[i] == 2) {
+				if(map[i] == 1) map.newRev.push(i);
+				map[i] = -1;
+				map.white++;
+			} 
+			else map[i] = 0;
+		}
+		map.last_side = map.side;
+		if(res.turn == 1){
+			map.side = 1;
+		}else{
+			map.side = -1;
+		}
+		if(map.last_side == map.side){
+			setPassStatus(true);
+		}
+		map.newPos = res.point;
+		map.next = res.available;
+		// update chess board
+		update();
+		
+		if(res.is_end){
+			alert("game end\nblack:" + map.black + ",white:" + map.white);
+			return;
+		}else{
+			if(map.side == -1){
+				setTimeout(oo.goChess, 700, -1);
+			}
+		}
+    }
+
+    function networkError(){
+		alert('something wrong with the network!');
+    }
+
+    // long poll the search of the AI until it is done
+    var title = document.title;
+    function pollJob(job, since){
+		$.ajax({
+			url: "/job/" + job,
+			type: "get",
+			data:{
+				"since": since
+			},
+			dataType: "json",
+			success:function(res){
+				if(res.state == "done" || res.state == "error"){
+					document.title = title;
+					onMove(res.result);
+				}else{
+					if(res.progress)
+						document.title = "AI: " + res.progress.playouts + " playouts";
+					pollJob(job, res.version);
+				}
+			},
+			error:networkError
+		})
+    }
+
     oo.goChess = function(n){
+		// the AI searches in the background, the human move is played at once
+		var async = map.side == -1;
 		$.ajax({
-			url: "/player/" + map.side,
+			url: (async ? "/async/player/" : "/player/") + map.side,
 			type: "get",
 			data:{
-				"point": n
+				"point": n,
+				"game": oo.game
 			},
 			dataType: "json",
 			success:function(res){
-				if(res.error == true){
-					alert("error!");
+				if(async && res.job){
+					pollJob(res.job, -1);
 				}else{
-					map.black = 0;
-					map.white = 0;
-					map.newRev = [];
-					for(var i = 0; i < 64; i++){
-						if(res.board[i] == 1) {
-							if(map[i] == -1) map.newRev.push(i);
-							map[i] = 1;
-							map.black++;
-						}
-						else if(res.board[i] == 2) {
-							if(map[i] == 1) map.newRev.push(i);
-							map[i] = -1;
-							map.white++;
-						} 
-						else map[i] = 0;
-					}
-					map.last_side = map.side;
-					if(res.turn == 1){
-						map.side = 1;
-					}else{
-						map.side = -1;
-					}
-					if(map.last_side == map.side){
-						setPassStatus(true);
-					}
-					map.newPos = res.point;
-					map.next = res.available;
-					// update chess board
-					update();
-					
-					if(res.is_end){
-						alert("game end\nblack:" + map.black + ",white:" + map.white);
-						return;
-					}else{
-						if(map.side == -1){
-							setTimeout(oo.goChess, 700, -1);
-						}
-					}
+					onMove(res);
 				}
 			},
-			error:function(){
-				alert('something wrong with the network!');
-				return;
-			}
+			error:networkError
 		})
     }
 	// set status
@@ -168,7 +207,10 @@ document.getElementById("play").onclick = function() {
 	$.ajax({
 		url: "/restart",
 		type: "get",
-		success:function(){
+		data: othe.game ? {"game": othe.game} : {},
+		dataType: "json",
+		success:function(res){
+			othe.game = res.game;
 			othe.play();
 		},
 		error:function(){
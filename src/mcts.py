@@ -8,11 +8,18 @@ If you have any question, pls contact me
 at djh113@126.com
 """
 
-import numpy as np
 import copy
-import board
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from operator import itemgetter
 
+import numpy as np
+import board
+import rollout
+from spawn import spawn_executor
+
 
 def rollout_policy_fn(b: board.Board):
     """ fast policy """
@@ -27,120 +34,402 @@ def policy_val_fn(b: board.Board):
     return zip(b.available, action_p), 0
 
 
+def known_move(b: board.Board, book=None, solver=None):
+    """
+    the move of the opening book or of the endgame solver (see endgame.py)
+    for b, None if neither of them knows the position
+    a lost position is left to the search, which looks for the
+    moves where the opponent is the most likely to go wrong
+    """
+    if book is not None:
+        move = book.move(b)
+        if move is not None:
+            return move
+    if solver is not None:
+        solved = solver.move(b)
+        if solved is not None and solved[1] >= 0:
+            return solved[0]
+    return None
+
+
+def time_left(time_ms, start):
+    """ what is left of a budget of time_ms milliseconds started at start (perf_counter) """
+    if time_ms is None:
+        return None
+    return max(0.0, time_ms - (time.perf_counter() - start) * 1000.0)
+
+
+def undo_playout(state: board.Board, path: list, player: int):
+    """
+    walk back up to the position where the playout started
+    path: undo records returned by state.draw
+    """
+    while path:
+        state.undo(path.pop())
+    if state.current_player != player:
+        # game_end passed without any move
+        state.current_player = player
+        state.can_play()
+
+
+def merge_visits(results):
+    """
+    sum the root visit counts of independent searches
+    results: list of (actions, visits)
+    return actions, visits
+    """
+    total = {}
+    for acts, visits in results:
+        for act, visit in zip(acts, visits):
+            total[act] = total.get(act, 0) + int(visit)
+    acts = sorted(total)
+    return acts, np.array([total[act] for act in acts])
+
+
+def _root_search(args):
+    """
+    one independent search of root parallel MCTS, run in a worker process
+    return actions and visit counts of the root
+    """
+    state, c, n_play, n_rollout, seed = args
+    # forked workers share the random state of the parent
+    np.random.seed(seed)
+    mcts = MCTS(policy_val_fn, c, n_play, n_rollout=n_rollout)
+    for n in range(n_play):
+        mcts.m_playout(state)
+    acts, visits = mcts.m_tree.child_visits(mcts.m_tree.m_root)
+    return acts, visits.tolist()
+
+
+def run_search(playout, tree, n_play=None, time_ms=None, early_stop=False,
+               progress=None, every_ms=100):
+    """
+    anytime search loop, call playout until n_play playouts are done
+    or time_ms milliseconds have passed, whichever comes first
+    playout: function of the number of playouts left (None if unbounded),
+    doing some playouts and returning how many
+    early_stop: also stop once the most visited child of the root
+    can not be overtaken by the playouts left
+    progress: function of the playouts done, called every every_ms
+    milliseconds from the search thread, e.g. to report the best move so far
+    return the number of playouts done
+    """
+    assert n_play is not None or time_ms is not None, 'search needs a budget'
+    start = time.perf_counter()
+    deadline = None if time_ms is None else start + time_ms / 1000.0
+    report = start + every_ms / 1000.0
+    done = 0
+    while n_play is None or done < n_play:
+        done += playout(None if n_play is None else n_play - done)
+        now = time.perf_counter()
+        if progress is not None and now >= report:
+            progress(done)
+            report = now + every_ms / 1000.0
+        if deadline is not None and now >= deadline:
+            break
+        if early_stop:
+            left = float('inf') if n_play is None else n_play - done
+            if deadline is not None:
+                # playouts expected in the time left
+                left = min(left, done * (deadline - now) / (now - start))
+            if tree.lead(tree.m_root) > left:
+                break
+    return done
+
+
 def softmax(x):
     p = np.exp(x - np.max(x))
     p /= np.sum(p)
     return p
 
 
-class TreeNode(object):
+class Tree(object):
     """
-    Each node in MCTS, which keeps track of its own value Q,
-    prior probability P, and score u
+    Search tree stored as arrays (struct of arrays),
+    a node is an integer index, children of a node are contiguous.
+    For each node we keep its visit count, value Q, prior probability P,
+    the action leading to it, its parent and its range of children
     """
 
-    def __init__(self, parent, prior):
-        self.m_parent = parent
-        # map(action, TreeNode)
-        self.m_child = {}
-        self.m_visit = 0
-        self.m_Q = 0
-        self.m_u = 0
-        self.m_P = prior
+    def __init__(self, capacity=1024):
+        self.m_capacity = 0
+        self.m_visit = np.zeros(0, np.int32)
+        self.m_Q = np.zeros(0, np.float32)
+        self.m_P = np.zeros(0, np.float32)
+        # pending playouts through this node, counted as losses
+        self.m_vloss = np.zeros(0, np.int32)
+        self.m_parent = np.zeros(0, np.int32)
+        self.m_action = np.zeros(0, np.int8)
+        self.m_first = np.zeros(0, np.int32)
+        self.m_nchild = np.zeros(0, np.int8)
+        # map(Board.key, expanded node), for sharing transpositions
+        self.m_table = {}
+        self.m_grow(capacity)
+        self.m_root = 0
+        self.m_size = 1
+        self.reset()
+
+    def m_grow(self, capacity):
+        """ enlarge the arrays to hold capacity nodes """
+        for name in ('m_visit', 'm_Q', 'm_P', 'm_vloss', 'm_parent',
+                     'm_action', 'm_first', 'm_nchild'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.m_capacity = capacity
 
-    def expand(self, action_p):
+    def reset(self):
+        """ drop all nodes but a fresh root """
+        self.m_root = 0
+        self.m_size = 1
+        self.m_visit[0] = 0
+        self.m_Q[0] = 0
+        self.m_P[0] = 1.0
+        self.m_vloss[0] = 0
+        self.m_parent[0] = -1
+        self.m_action[0] = -1
+        self.m_nchild[0] = 0
+        self.m_table = {}
+
+    def __len__(self):
+        return self.m_size
+
+    def is_leaf(self, node):
+        """ check node is leaf """
+        return self.m_nchild[node] == 0
+
+    def children(self, node):
+        """ range of the children of node """
+        start = self.m_first[node]
+        return start, start + self.m_nchild[node]
+
+    def expand(self, node, action_p):
         """
         Creating new node (child)
         action_p is list of action and corresponding prior probability
         according to policy function
         """
-        for action, pro in action_p:
-            if action not in self.m_child:
-                self.m_child[action] = TreeNode(self, pro)
-
-    def select(self, c):
+        if self.m_nchild[node]:
+            return
+        action_p = list(action_p)
+        n = len(action_p)
+        if n == 0:
+            return
+        start = self.m_size
+        if start + n > self.m_capacity:
+            self.m_grow(max(2 * self.m_capacity, start + n))
+        end = start + n
+        actions, probs = zip(*action_p)
+        self.m_action[start:end] = actions
+        self.m_P[start:end] = probs
+        self.m_visit[start:end] = 0
+        self.m_Q[start:end] = 0
+        self.m_vloss[start:end] = 0
+        self.m_parent[start:end] = node
+        self.m_nchild[start:end] = 0
+        self.m_first[node] = start
+        self.m_nchild[node] = n
+        self.m_size = end
+
+    def expand_like(self, node, other):
+        """ give node the same children (actions and priors) as other """
+        start, end = self.children(other)
+        self.expand(node, zip(self.m_action[start:end].tolist(), self.m_P[start:end].tolist()))
+
+    def transposition(self, key, node):
         """
-        Select action among child which Q is max
-        Return (action, node)
+        return an expanded and visited node of the same position
+        (key is Board.key) other than node, or None
         """
-        return max(self.m_child.items(), key=lambda node: node[1].get_value(c))
+        other = self.m_table.get(key)
+        if other is None or other == node or self.m_visit[other] == 0:
+            return None
+        return other
 
-    def update(self, leaf_val):
+    def select(self, node, c):
         """
-        Update node value from leaf
-        leaf_val : value evaluated from subtree
+        Select the child of node which Q + u is max
+        Q + c * p * sqrt(n) / (ni + 1)
+        c is a hyper-parameter, which measure the degree of
+        impact of the value Q
+        Return child
         """
-        self.m_visit += 1
-        # update Q
-        self.m_Q += 1.0 * (leaf_val - self.m_Q) / self.m_visit
+        start = int(self.m_first[node])
+        end = start + int(self.m_nchild[node])
+        if self.m_vloss[node]:
+            # virtual loss: every pending playout counts as a lost visit
+            vloss = self.m_vloss[start:end]
+            visit = self.m_visit[start:end] + vloss
+            Q = (self.m_Q[start:end] * self.m_visit[start:end] - vloss) / np.maximum(visit, 1)
+            sq = c * math.sqrt(self.m_visit[node] + self.m_vloss[node])
+        else:
+            visit = self.m_visit[start:end]
+            Q = self.m_Q[start:end]
+            sq = c * math.sqrt(self.m_visit[node])
+        return start + int((Q + self.m_P[start:end] * sq / (visit + 1.0)).argmax())
 
-    def updates(self, leaf_val):
+    def updates(self, nodes, leaf_val):
         """
-        Update node value recursively
+        Update value of nodes (root ... leaf) from leaf
+        leaf_val : value evaluated from subtree, seen from the leaf,
+        the sign flips at each level up
         """
-        if self.m_parent:
-            self.m_parent.updates(-leaf_val)
-        self.update(leaf_val)
+        nodes = np.asarray(nodes)
+        values = np.full(len(nodes), leaf_val, np.float32)
+        values[-2::-2] = -leaf_val
+        self.m_visit[nodes] += 1
+        # update Q
+        self.m_Q[nodes] += (values - self.m_Q[nodes]) / self.m_visit[nodes]
 
-    def get_value(self, c):
+    def add_virtual_loss(self, nodes, n=1):
         """
-        calculate the value for this node
-        c is a hyper-parameter, which measure the degree of
-        impact of the value Q
-        Q / ni + c * p * sqrt(n / (ni + 1))
+        Mark a pending playout on nodes (root ... leaf)
+        n = -1 takes the mark back
         """
+        self.m_vloss[nodes] += n
 
-        self.m_u = (c * self.m_P * np.sqrt(self.m_parent.m_visit) / (1 + self.m_visit))
-        return self.m_Q + self.m_u
+    def lead(self, node):
+        """ visits of the most visited child of node minus the second one """
+        start, end = self.children(node)
+        if end - start < 2:
+            return int(self.m_visit[start:end].sum()) if end > start else 0
+        second, first = np.partition(self.m_visit[start:end], -2)[-2:]
+        return int(first) - int(second)
 
-    def is_leaf(self):
-        """ check node is leaf """
-        return self.m_child == {}
+    def child_visits(self, node):
+        """ return actions and visit counts of the children of node """
+        start, end = self.children(node)
+        return self.m_action[start:end].tolist(), self.m_visit[start:end]
 
-    def is_root(self):
-        return self.m_parent is None
+    def update_and_move(self, last_move):
+        """
+        Step forward in the tree, the subtree of last_move becomes the tree
+        """
+        start, end = self.children(self.m_root)
+        hit = np.flatnonzero(self.m_action[start:end] == last_move)
+        if last_move < 0 or len(hit) == 0:
+            self.reset()
+            return
+        self.m_compact(start + int(hit[0]))
+
+    def m_compact(self, root):
+        """
+        move the subtree of root to the front of the arrays,
+        level by level so the children stay contiguous
+        """
+        levels = [np.array([root], np.int32)]
+        frontier = levels[0]
+        while True:
+            counts = self.m_nchild[frontier].astype(np.int64)
+            total = int(counts.sum())
+            if total == 0:
+                break
+            offsets = np.cumsum(counts) - counts
+            frontier = (np.arange(total) - np.repeat(offsets, counts) +
+                        np.repeat(self.m_first[frontier], counts)).astype(np.int32)
+            levels.append(frontier)
+        order = np.concatenate(levels)
+        n = len(order)
+        new_id = np.full(self.m_capacity, -1, np.int32)
+        new_id[order] = np.arange(n, dtype=np.int32)
+        for name in ('m_visit', 'm_Q', 'm_P', 'm_vloss', 'm_action', 'm_nchild'):
+            arr = getattr(self, name)
+            arr[:n] = arr[order]
+        parent = self.m_parent[order]
+        first = self.m_first[order]
+        self.m_parent[:n] = np.where(parent >= 0, new_id[parent], -1)
+        self.m_parent[0] = -1
+        self.m_first[:n] = np.where(self.m_nchild[:n] > 0, new_id[first], 0)
+        self.m_table = {key: int(new_id[node]) for key, node in self.m_table.items()
+                        if new_id[node] >= 0}
+        self.m_root = 0
+        self.m_size = n
 
 
 class MCTS(object):
     """ Monte Carlo Tree Search """
 
-    def __init__(self, policy_val_f, c=5, n_play=1000):
+    def __init__(self, policy_val_f, c=5, n_play=1000, share=False,
+                 parallel=None, workers=1, n_rollout=1, time_ms=None, early_stop=False):
         """
         policy_val_f: function that takes board status as input,
         output the (action, probability) and score
         c: hyperparameter, which controls how quickly exploration
         converges to max-val policy
+        share: reuse the expansion and value of a node reached
+        by another move order (transposition)
+        parallel: None or 'root', see get_move
+        workers: number of parallel searches
+        n_rollout: number of random games averaged per leaf,
+        more than 1 plays them together with the vectorized rollout engine
+        time_ms: time budget per move in milliseconds, on top of n_play
+        early_stop: stop once the best move can not change any more
         """
-        self.m_root = TreeNode(None, 1.0)
+        self.m_tree = Tree()
+        # moves played on the board to reach the root of the tree
+        self.m_history = []
         self.m_policy = policy_val_f
         self.m_c = c
         self.m_nplay = n_play
+        self.m_share = share
+        self.m_rollout = n_rollout
+        self.m_time_ms = time_ms
+        self.m_early_stop = early_stop
+        # the rollouts are python, threads on one tree would only share the GIL
+        assert parallel in (None, 'root'), 'Invalid parallel mode'
+        self.m_parallel = parallel
+        self.m_workers = workers
+        self.m_executor = None
 
     def m_playout(self, state: board.Board):
-        node = self.m_root
+        """
+        run a playout from the root, state is modified on the way
+        down and restored before return
+        """
+        tree = self.m_tree
+        node = tree.m_root
+        nodes = [node]
+        player = state.get_current_player()
+        path = []
         while True:
-            if node.is_leaf():
+            if tree.is_leaf(node):
                 break
             # select next node to go
-            action, node = node.select(self.m_c)
-            state.draw(action)
-            # update
-            state.can_play()
+            node = tree.select(node, self.m_c)
+            nodes.append(node)
+            path.append(state.draw(tree.m_action[node]))
+        key = state.key()
+        if self.m_share:
+            other = tree.transposition(key, node)
+            if other is not None:
+                # same position as other, take its children and value
+                tree.expand_like(node, other)
+                tree.updates(nodes, tree.m_Q[other])
+                undo_playout(state, path, player)
+                return
         action_p, _ = self.m_policy(state)
         # check
         end, winner = state.game_end()
         if not end:
-            node.expand(action_p)
+            tree.expand(node, action_p)
+            if self.m_share and not tree.is_leaf(node):
+                tree.m_table[key] = node
         # evaluation the leaf node
-        leaf_val = self.m_eval_rollout(state)
+        if self.m_rollout > 1:
+            leaf_val = self.m_eval_rollout_batch(state)
+        else:
+            leaf_val = self.m_eval_rollout(state, path)
         # update value
-        node.updates(-leaf_val)
+        tree.updates(nodes, -leaf_val)
+        undo_playout(state, path, player)
 
-    def m_eval_rollout(self, state: board.Board, limit=128):
+    def m_eval_rollout(self, state: board.Board, path=None, limit=128):
         """
         using rollout policy to play game until game over
         return 1 if current player win,
         -1 if it is lost and 0 if it is a tie
+        path: if given, the undo records of the rollout are appended
         """
         player = state.get_current_player()
         for i in range(limit):
@@ -149,48 +438,129 @@ class MCTS(object):
                 break
             action_p = rollout_policy_fn(state)
             max_action = max(action_p, key=itemgetter(1))[0]
-            state.draw(max_action)
+            record = state.draw(max_action)
+            if path is not None:
+                path.append(record)
         if winner == -1:
             return 0
         else:
             return 1 if winner == player else -1
 
-    def get_move(self, state: board.Board):
-        """ return selected state """
-        for n in range(self.m_nplay):
-            state_copy = copy.deepcopy(state)
-            self.m_playout(state_copy)
-        return max(self.m_root.m_child.items(), key=lambda node: node[1].m_visit)[0]
+    def m_search_root(self, state: board.Board):
+        """ independent searches in worker processes, return merged root visits """
+        if self.m_executor is None:
+            # spawned, forking a process running threads (server, pondering) can deadlock
+            self.m_executor = spawn_executor(self.m_workers)
+        seeds = np.random.randint(2 ** 31, size=self.m_workers)
+        jobs = [(state, self.m_c, self.m_nplay, self.m_rollout, seed) for seed in seeds]
+        return merge_visits(self.m_executor.map(_root_search, jobs))
+
+    def m_eval_rollout_batch(self, state: board.Board):
+        """
+        play n_rollout random games from state at once,
+        return the mean score of the current player
+        """
+        own = np.full(self.m_rollout, state.pieces[state.current_player], np.uint64)
+        opp = np.full(self.m_rollout, state.pieces[state.opponent()], np.uint64)
+        return rollout.rollout(own, opp).mean()
+
+    def get_move(self, state: board.Board, start=None):
+        """
+        return selected state
+        'root' runs independent trees in worker processes and sums the root visits,
+        workers times the playouts on as many cores
+        the time budget and early stop apply to the serial search
+        start: perf_counter when the move started, the time spent since
+        (e.g. by the endgame solver) is taken off the time budget
+        """
+        if self.m_parallel == 'root':
+            acts, visits = self.m_search_root(state)
+            return acts[int(np.argmax(visits))]
+
+        def playout(left):
+            self.m_playout(state)
+            return 1
+
+        time_ms = self.m_time_ms if start is None else time_left(self.m_time_ms, start)
+        run_search(playout, self.m_tree, self.m_nplay, time_ms, self.m_early_stop)
+        acts, visits = self.m_tree.child_visits(self.m_tree.m_root)
+        return acts[int(np.argmax(visits))]
 
     def update_and_move(self, last_move):
         """
-        Step forward in the tree
+        Step forward in the tree, -1 starts a new tree
+        """
+        self.m_tree.update_and_move(last_move)
+        if last_move == -1:
+            self.m_history = []
+
+    def sync(self, state: board.Board):
+        """
+        Step forward in the tree along the moves played on state
+        since the last sync or step, e.g. the reply of the opponent,
+        start a new tree if state is not a continuation of them
         """
-        if last_move in self.m_root.m_child:
-            self.m_root = self.m_root.m_child[last_move]
-            self.m_root.m_parent = None
+        n = len(self.m_history)
+        if state.moves[:n] != self.m_history:
+            self.m_tree.reset()
         else:
-            self.m_root = TreeNode(None, 1.0)
+            for move in state.moves[n:]:
+                self.m_tree.update_and_move(move)
+        self.m_history = list(state.moves)
+
+    def step(self, move):
+        """ Step forward in the tree along our own move """
+        self.m_tree.update_and_move(move)
+        self.m_history.append(move)
+
+    def close(self):
+        """ stop the workers of the parallel search """
+        if self.m_executor is not None:
+            self.m_executor.shutdown()
+            self.m_executor = None
 
     def __str__(self):
         return 'MCTS'
 
 
 class MCTS_Player(object):
-    def __init__(self, c=5, playout=20):
-        self.mcts = MCTS(policy_val_fn, c, playout)
+    def __init__(self, c=5, playout=20, share=False, parallel=None, workers=1, n_rollout=1,
+                 time_ms=None, early_stop=False, book=None, solver=None):
+        """
+        parallel: None or 'root' (independent searches in a process pool)
+        workers: number of parallel searches, each doing playout playouts
+        n_rollout: random games averaged per leaf
+        time_ms: time budget per move in milliseconds, on top of playout
+        early_stop: stop searching once the best move is settled
+        book: opening Book, its moves are played without searching
+        solver: endgame Solver, plays the positions with few empty points
+        """
+        self.mcts = MCTS(policy_val_fn, c, playout, share, parallel, workers, n_rollout,
+                         time_ms, early_stop)
+        self.m_book = book
+        self.m_solver = solver
 
     def set_index(self, p):
         self.player = p
 
     def reset(self):
         self.mcts.update_and_move(-1)
+        if self.m_solver is not None:
+            self.m_solver.clear()
+
+    def close(self):
+        self.mcts.close()
 
     def action(self, b: board.Board):
         option = b.available
         if len(option) > 0:
-            move = self.mcts.get_move(b)
-            self.mcts.update_and_move(-1)
+            # keep the subtree of the moves played since our last move
+            self.mcts.sync(b)
+            start = time.perf_counter()
+            move = known_move(b, self.m_book, self.m_solver)
+            if move is None:
+                move = self.mcts.get_move(b, start)
+            self.mcts.step(move)
             return move
         else:
             print('[WARNING]')
@@ -202,34 +572,83 @@ class MCTS_Player(object):
 class AI_MCTS(object):
     """ Monte Carlo Tree Search """
 
-    def __init__(self, policy_val_f, c=5, n_play=1000):
+    def __init__(self, policy_val_f, c=5, n_play=1000, batch_size=1, policy_val_batch=None,
+                 cache=None, share=False, parallel=None, workers=1,
+                 time_ms=None, nodes=None, early_stop=False):
         """
         policy_val_f: function that takes board status as input,
         output the (action, probability) and score
         c: hyperparameter, which controls how quickly exploration
         converges to max-val policy
+        batch_size: number of leaves evaluated together, using virtual loss
+        policy_val_batch: function that takes a batch of states (N * 4 * w * h),
+        output the action probability (N * (w * h)) and score (N * 1),
+        e.g. ValueNet.policy_value, needed when batch_size > 1
+        cache: EvalCache looked up before evaluating a position
+        share: reuse the expansion and value of a node reached
+        by another move order (transposition)
+        parallel: None, 'root' or 'tree', see get_move_p
+        workers: number of parallel searches
+        time_ms: time budget per move in milliseconds
+        nodes: playout budget per move
+        without any budget, 2 playouts per available move are done
+        early_stop: stop once the best move can not change any more
         """
-        self.m_root = TreeNode(None, 1.0)
+        self.m_tree = Tree()
+        # moves played on the board to reach the root of the tree
+        self.m_history = []
         self.m_policy = policy_val_f
         self.m_c = c
         self.m_nplay = n_play
+        self.m_cache = cache
+        self.m_share = share
+        assert parallel in (None, 'root', 'tree'), 'Invalid parallel mode'
+        self.m_parallel = parallel
+        self.m_workers = workers
+        self.m_executor = None
+        self.m_time_ms = time_ms
+        self.m_nodes = nodes
+        self.m_early_stop = early_stop
+        self.m_batch_size = batch_size
+        self.m_policy_batch = policy_val_batch
+        if batch_size > 1:
+            assert policy_val_batch is not None, 'batch search needs policy_val_batch'
+            self.m_states = np.empty((batch_size, 4, 8, 8), np.float32)
 
     def m_playout(self, state: board.Board):
-        node = self.m_root
+        """
+        run a playout from the root, state is modified on the way
+        down and restored before return
+        """
+        tree = self.m_tree
+        node = tree.m_root
+        nodes = [node]
+        player = state.get_current_player()
+        path = []
         while True:
-            if node.is_leaf():
+            if tree.is_leaf(node):
                 break
             # select next node
-            action, node = node.select(self.m_c)
-            state.draw(action)
-            # update available
-            state.can_play()
+            node = tree.select(node, self.m_c)
+            nodes.append(node)
+            path.append(state.draw(tree.m_action[node]))
+        key = state.key()
+        if self.m_share:
+            other = tree.transposition(key, node)
+            if other is not None:
+                # same position as other, take its children and value
+                tree.expand_like(node, other)
+                tree.updates(nodes, tree.m_Q[other])
+                undo_playout(state, path, player)
+                return
         # eval
-        action_p, leaf_val = self.m_policy(state)
+        action_p, leaf_val = self.m_evaluate(state)
         # check game is end
         end, winner = state.game_end()
         if not end:
-            node.expand(action_p)
+            tree.expand(node, action_p)
+            if self.m_share and not tree.is_leaf(node):
+                tree.m_table[key] = node
         else:
             # tie
             if winner == -1:
@@ -237,56 +656,340 @@ class AI_MCTS(object):
             else:
                 leaf_val = 1.0 if winner == state.get_current_player() else -1.0
         # update
-        node.updates(-leaf_val)
+        tree.updates(nodes, -leaf_val)
+        undo_playout(state, path, player)
+
+    def m_evaluate(self, state: board.Board):
+        """ policy_val_f through the cache """
+        if self.m_cache is None:
+            return self.m_policy(state)
+        key = self.m_cache.key(state)
+        entry = self.m_cache.lookup(key)
+        if entry is None:
+            entry = self.m_cache.store(key, *self.m_policy(state))
+        return entry
+
+    def m_playout_batch(self, state: board.Board, n: int):
+        """
+        run up to n playouts from the root, the leaves are
+        evaluated by one call of policy_val_batch
+        return the number of playouts done
+        """
+        tree = self.m_tree
+        player = state.get_current_player()
+        path = []
+        # (nodes from root to leaf, legal moves), one per row of the state batch
+        leaves = []
+        rows = {}
+        keys = []
+        # cache keys of the leaves
+        ckeys = []
+        done = 0
+        for i in range(n):
+            node = tree.m_root
+            nodes = [node]
+            while not tree.is_leaf(node):
+                node = tree.select(node, self.m_c)
+                nodes.append(node)
+                path.append(state.draw(tree.m_action[node]))
+            key = state.key()
+            other = tree.transposition(key, node) if self.m_share else None
+            if other is not None:
+                # same position as other, take its children and value
+                tree.expand_like(node, other)
+                tree.updates(nodes, tree.m_Q[other])
+                done += 1
+                undo_playout(state, path, player)
+                continue
+            legal = state.available
+            entry = None
+            if node not in rows:
+                if self.m_cache is not None:
+                    ckey = self.m_cache.key(state)
+                    entry = self.m_cache.lookup(ckey)
+                if entry is None:
+                    state.current_state(out=self.m_states[len(rows)])
+            end, winner = state.game_end()
+            if end or entry is not None:
+                # no need to wait for the batch
+                if end:
+                    if winner == -1:
+                        leaf_val = 0.0
+                    else:
+                        leaf_val = 1.0 if winner == state.get_current_player() else -1.0
+                else:
+                    tree.expand(node, entry[0])
+                    if self.m_share and not tree.is_leaf(node):
+                        tree.m_table[key] = node
+                    leaf_val = entry[1]
+                tree.updates(nodes, -leaf_val)
+                done += 1
+            elif node in rows:
+                # the virtual loss did not steer away from a pending leaf,
+                # stop collecting and evaluate what we have
+                undo_playout(state, path, player)
+                break
+            else:
+                # keep other playouts of this batch away from this path
+                tree.add_virtual_loss(nodes)
+                rows[node] = len(rows)
+                keys.append(key)
+                ckeys.append(ckey if self.m_cache is not None else None)
+                leaves.append((nodes, legal))
+            undo_playout(state, path, player)
+        # evaluate all leaves at once
+        if not leaves:
+            return done
+        act_probs, values = self.m_policy_batch(self.m_states[:len(leaves)])
+        for row, (nodes, legal) in enumerate(leaves):
+            tree.add_virtual_loss(nodes, -1)
+            action_p = zip(legal, act_probs[row][legal])
+            if self.m_cache is not None:
+                action_p = self.m_cache.store(ckeys[row], action_p, values[row:row + 1])[0]
+            tree.expand(nodes[-1], action_p)
+            if self.m_share and not tree.is_leaf(nodes[-1]):
+                tree.m_table[keys[row]] = nodes[-1]
+            tree.updates(nodes, -values[row][0])
+        return done + len(leaves)
+
+    def m_playout_shared(self, state: board.Board, lock):
+        """
+        playout of tree parallel search, the tree is shared
+        by all threads and guarded by lock, state is owned by the thread
+        """
+        tree = self.m_tree
+        player = state.get_current_player()
+        path = []
+        entry = None
+        with lock:
+            node = tree.m_root
+            nodes = [node]
+            while not tree.is_leaf(node):
+                node = tree.select(node, self.m_c)
+                nodes.append(node)
+                path.append(state.draw(tree.m_action[node]))
+            # keep other threads away from this path
+            tree.add_virtual_loss(nodes)
+            if self.m_cache is not None:
+                key = self.m_cache.key(state)
+                entry = self.m_cache.lookup(key)
+        # the network runs without the lock
+        if entry is None:
+            action_p, leaf_val = self.m_policy(state)
+            action_p = list(action_p)
+        else:
+            action_p, leaf_val = entry
+        end, winner = state.game_end()
+        with lock:
+            if entry is None and self.m_cache is not None:
+                self.m_cache.store(key, action_p, leaf_val)
+            if not end:
+                tree.expand(node, action_p)
+            elif winner == -1:
+                leaf_val = 0.0
+            else:
+                leaf_val = 1.0 if winner == state.get_current_player() else -1.0
+            tree.add_virtual_loss(nodes, -1)
+            tree.updates(nodes, -leaf_val)
+        undo_playout(state, path, player)
+
+    def m_search_tree(self, state: board.Board, n_play: int):
+        """ n_play playouts spread over threads sharing one tree """
+        if self.m_executor is None:
+            self.m_executor = ThreadPoolExecutor(self.m_workers)
+        lock = threading.Lock()
+
+        def work(n):
+            b = copy.deepcopy(state)
+            for i in range(n):
+                self.m_playout_shared(b, lock)
 
-    def get_move_p(self, state: board.Board, tmp=1e-3):
-        self.m_nplay = len(state.available) * 2
-        for n in range(self.m_nplay):
-            state_copy = copy.deepcopy(state)
-            self.m_playout(state_copy)
+        share = [n_play // self.m_workers + (i < n_play % self.m_workers) for i in range(self.m_workers)]
+        list(self.m_executor.map(work, share))
+
+    def m_search_root(self, state: board.Board, time_ms=None):
+        """
+        independent searches in threads (the network does not
+        pickle, and releases the GIL while running), return merged root visits
+        """
+        if self.m_executor is None:
+            self.m_executor = ThreadPoolExecutor(self.m_workers)
+
+        def work(i):
+            mcts = AI_MCTS(self.m_policy, self.m_c, self.m_nplay,
+                           self.m_batch_size, self.m_policy_batch,
+                           time_ms=time_ms, nodes=self.m_nodes,
+                           early_stop=self.m_early_stop)
+            b = copy.deepcopy(state)
+            mcts.get_move_p(b)
+            acts, visits = mcts.m_tree.child_visits(mcts.m_tree.m_root)
+            return acts, visits.copy()
+
+        return merge_visits(self.m_executor.map(work, range(self.m_workers)))
+
+    def ponder(self, state: board.Board, stop, max_nodes=200000):
+        """
+        keep searching from state until stop (threading.Event) is set,
+        e.g. while the opponent thinks, the tree keeps what was found
+        max_nodes: stop growing the tree beyond this size
+        """
+        self.sync(state)
+        while not stop.is_set() and len(self.m_tree) < max_nodes:
+            if self.m_batch_size > 1:
+                self.m_playout_batch(state, self.m_batch_size)
+            else:
+                self.m_playout(state)
+
+    def report(self, playouts=None):
+        """
+        the search so far: best move, visits of the root moves,
+        value of the best move for the player to move and playouts done
+        """
+        tree = self.m_tree
+        acts, visits = tree.child_visits(tree.m_root)
+        if len(acts) == 0:
+            return {'best': None, 'visits': {}, 'value': 0.0, 'playouts': playouts or 0}
+        best = int(np.argmax(visits))
+        return {'best': acts[best],
+                'visits': dict(zip(acts, visits.tolist())),
+                'value': float(tree.m_Q[tree.children(tree.m_root)[0] + best]),
+                'playouts': int(visits.sum()) if playouts is None else playouts}
+
+    def get_move_p(self, state: board.Board, tmp=1e-3, progress=None, start=None):
+        """
+        return actions and their probability
+        parallel search does workers times the playouts, in threads which
+        overlap while the network runs (it releases the GIL):
+        'root' runs independent trees and sums the root visits,
+        'tree' runs threads on one tree, kept apart by virtual loss
+        the time budget and early stop apply to the serial and batched search
+        progress: called with report() while searching and once at the end
+        start: perf_counter when the move started, the time spent since
+        (e.g. by the endgame solver) is taken off the time budget
+        """
+        time_ms = self.m_time_ms if start is None else time_left(self.m_time_ms, start)
+        if self.m_time_ms is None and self.m_nodes is None:
+            self.m_nplay = len(state.available) * 2
+        elif self.m_nodes is not None:
+            self.m_nplay = self.m_nodes
+        if self.m_parallel == 'root':
+            acts, visits = self.m_search_root(state, time_ms)
+        else:
+            if self.m_parallel == 'tree':
+                self.m_search_tree(state, self.m_nplay * self.m_workers)
+            else:
+                def playout(left):
+                    if self.m_batch_size > 1:
+                        return self.m_playout_batch(state, min(self.m_batch_size, left or self.m_batch_size))
+                    self.m_playout(state)
+                    return 1
+
+                n_play = None if self.m_nodes is None and self.m_time_ms is not None else self.m_nplay
+                run_search(playout, self.m_tree, n_play, time_ms, self.m_early_stop,
+                           None if progress is None else lambda n: progress(self.report(n)))
+            acts, visits = self.m_tree.child_visits(self.m_tree.m_root)
+            if progress is not None:
+                progress(self.report())
 
         # calculate the move probability
-        act_visit = [(act, node.m_visit) for act, node in self.m_root.m_child.items()]
-        acts, visits = zip(*act_visit)
-        act_p = softmax(1.0 / tmp * np.log(np.array(visits) + 1e-10))
+        act_p = softmax(1.0 / tmp * np.log(visits + 1e-10))
         return acts, act_p
 
     def update_and_move(self, last_move):
-        if last_move in self.m_root.m_child:
-            self.m_root = self.m_root.m_child[last_move]
-            self.m_root.m_parent = None
+        self.m_tree.update_and_move(last_move)
+        if last_move == -1:
+            self.m_history = []
+
+    def sync(self, state: board.Board):
+        """
+        Step forward in the tree along the moves played on state
+        since the last sync or step, e.g. the reply of the opponent,
+        start a new tree if state is not a continuation of them
+        """
+        n = len(self.m_history)
+        if state.moves[:n] != self.m_history:
+            self.m_tree.reset()
         else:
-            self.m_root = TreeNode(None, 1.0)
+            for move in state.moves[n:]:
+                self.m_tree.update_and_move(move)
+        self.m_history = list(state.moves)
+
+    def step(self, move):
+        """ Step forward in the tree along our own move """
+        self.m_tree.update_and_move(move)
+        self.m_history.append(move)
+
+    def close(self):
+        """ stop the workers of the parallel search """
+        if self.m_executor is not None:
+            self.m_executor.shutdown()
+            self.m_executor = None
 
 
 class AI_MCTS_Player(object):
-    def __init__(self, policy_val_fun, c=5, playout=200, self_play=False):
-        self.mcts = AI_MCTS(policy_val_fun, c, playout)
+    def __init__(self, policy_val_fun, c=5, playout=200, self_play=False,
+                 batch_size=1, policy_val_batch=None, cache=None, share=False,
+                 parallel=None, workers=1, time_ms=None, nodes=None, early_stop=False,
+                 book=None, solver=None):
+        """
+        batch_size > 1 evaluates that many leaves per network call,
+        policy_val_batch is then the batch evaluation, e.g. ValueNet.policy_value
+        cache: EvalCache in front of policy_val_fun
+        share: share the nodes of transpositions in the search
+        parallel: None, 'root' or 'tree', searches with workers threads
+        time_ms, nodes: per move budget in milliseconds and in playouts,
+        either or both, early_stop: stop once the best move is settled
+        book: opening Book, its moves are played without searching
+        solver: endgame Solver, plays the positions with few empty points
+        """
+        self.mcts = AI_MCTS(policy_val_fun, c, playout, batch_size, policy_val_batch,
+                            cache, share, parallel, workers, time_ms, nodes, early_stop)
         self.m_self_play = self_play
+        self.m_book = book
+        self.m_solver = solver
+
+    def set_budget(self, time_ms=None, nodes=None, early_stop=False):
+        """ change the per move budget of the search """
+        self.mcts.m_time_ms = time_ms
+        self.mcts.m_nodes = nodes
+        self.mcts.m_early_stop = early_stop
 
     def set_index(self, p):
         self.player = p
 
     def reset(self):
         self.mcts.update_and_move(-1)
+        if self.m_solver is not None:
+            self.m_solver.clear()
+
+    def close(self):
+        self.mcts.close()
 
-    def action(self, b: board.Board, tmp=1e-3, ret_p=False):
+    def action(self, b: board.Board, tmp=1e-3, ret_p=False, progress=None):
+        """ progress: called with the state of the search, see AI_MCTS.report """
         moves = b.available
         # pi
         moves_p = np.zeros(b.width * b.height)
         if len(moves) > 0:
-            acts, prob = self.mcts.get_move_p(b, tmp)
+            # keep the subtree of the moves played since our last move
+            self.mcts.sync(b)
+            start = time.perf_counter()
+            move = known_move(b, self.m_book, self.m_solver)
+            if move is not None:
+                self.mcts.step(move)
+                moves_p[move] = 1.0
+                return (move, moves_p) if ret_p else move
+            acts, prob = self.mcts.get_move_p(b, tmp, progress, start)
             moves_p[list(acts)] = prob
             if self.m_self_play:
                 # self-play training
                 move = np.random.choice(
                     acts,
                     p=0.75 * prob + 0.25 * np.random.dirichlet(0.3 * np.ones(len(prob))))
-                # update
-                self.mcts.update_and_move(move)
             else:
                 move = np.random.choice(acts, p=prob)
-                self.mcts.update_and_move(-1)
+            # update
+            self.mcts.step(int(move))
 
             if ret_p:
                 return move, moves_p
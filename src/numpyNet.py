@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+forward pass of ValueNet in numpy, no Tensorflow needed
+the weights are read straight from the Tensorflow checkpoint files
+(model.index and model.data-*), the convolutions are im2col + matmul
+"""
+import struct
+
+import numpy as np
+
+# Tensorflow DataType enum -> numpy
+_DTYPES = {1: np.float32, 2: np.float64, 3: np.int32, 9: np.int64, 19: np.float16}
+# last 8 bytes of a table file
+_MAGIC = 0xdb4775248b80fb57
+
+
+def _varint(buf, pos):
+    """ decode a varint at pos, return (value, next pos) """
+    res = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        res |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return res, pos
+        shift += 7
+
+
+def _fields(buf):
+    """ (field number, value) of a protobuf message, values of length-delimited fields as bytes """
+    pos = 0
+    while pos < len(buf):
+        key, pos = _varint(buf, pos)
+        wire = key & 7
+        if wire == 0:
+            value, pos = _varint(buf, pos)
+        elif wire == 1:
+            value = struct.unpack_from('<Q', buf, pos)[0]
+            pos += 8
+        elif wire == 2:
+            n, pos = _varint(buf, pos)
+            value = buf[pos:pos + n]
+            pos += n
+        elif wire == 5:
+            value = struct.unpack_from('<I', buf, pos)[0]
+            pos += 4
+        else:
+            raise ValueError('unsupported wire type {}'.format(wire))
+        yield key >> 3, value
+
+
+def _block(buf, offset, size):
+    """ (key, value) entries of a table block, keys are prefix compressed """
+    data = buf[offset:offset + size]
+    n_restarts = struct.unpack_from('<I', data, len(data) - 4)[0]
+    end = len(data) - 4 - 4 * n_restarts
+    pos, key = 0, b''
+    while pos < end:
+        shared, pos = _varint(data, pos)
+        non_shared, pos = _varint(data, pos)
+        n, pos = _varint(data, pos)
+        key = key[:shared] + data[pos:pos + non_shared]
+        pos += non_shared
+        yield key, data[pos:pos + n]
+        pos += n
+
+
+def read_index(path):
+    """
+    entries of a checkpoint index file (an uncompressed table of BundleEntryProto)
+    return (number of data shards, {name: (dtype, shape, shard, offset, size)})
+    """
+    with open(path, 'rb') as f:
+        buf = f.read()
+    assert struct.unpack_from('<Q', buf, len(buf) - 8)[0] == _MAGIC, 'not a checkpoint index'
+    # footer: metaindex handle, index handle
+    pos = len(buf) - 48
+    _, pos = _varint(buf, pos)
+    _, pos = _varint(buf, pos)
+    index_offset, pos = _varint(buf, pos)
+    index_size, pos = _varint(buf, pos)
+    shards, entries = 1, {}
+    for _, handle in _block(buf, index_offset, index_size):
+        offset, p = _varint(handle, 0)
+        size, p = _varint(handle, p)
+        for key, value in _block(buf, offset, size):
+            fields = dict(_fields(value))
+            if key == b'':
+                # BundleHeaderProto
+                shards = fields.get(1, 1)
+                continue
+            shape = tuple(dict(_fields(dim)).get(1, 0)
+                          for num, dim in _fields(fields.get(2, b'')) if num == 2)
+            entries[key.decode()] = (fields.get(1, 0), shape, fields.get(3, 0),
+                                     fields.get(4, 0), fields.get(5, 0))
+    return shards, entries
+
+
+def read_checkpoint(model_path):
+    """ {variable name: numpy array} of a Tensorflow checkpoint, without Tensorflow """
+    shards, entries = read_index(model_path + '.index')
+    data = {}
+    weights = {}
+    for name, (dtype, shape, shard, offset, size) in entries.items():
+        if dtype not in _DTYPES:
+            continue
+        if shard not in data:
+            with open('{}.data-{:05d}-of-{:05d}'.format(model_path, shard, shards), 'rb') as f:
+                data[shard] = f.read()
+        weights[name] = np.frombuffer(data[shard], _DTYPES[dtype], size // np.dtype(_DTYPES[dtype]).itemsize,
+                                      offset).reshape(shape).copy()
+    return weights
+
+
+class NumpyNet(object):
+    """ same interface as ValueNet for playing: policy_value and policy_value_fn """
+
+    # variables of the layers, in the order ValueNet builds them
+    TRUNK = ('conv2d', 'conv2d_1', 'conv2d_2')
+    ACTION_CONV, EVALUATION_CONV = 'conv2d_3', 'conv2d_4'
+    ACTION_FC, EVALUATION_FC1, EVALUATION_FC2 = 'dense', 'dense_1', 'dense_2'
+
+    def __init__(self, width=8, height=8, model=None, dtype=np.float32):
+        """
+        model: Tensorflow checkpoint of ValueNet
+        dtype: dtype the layers are computed in
+        """
+        self._width = width
+        self._height = height
+        self.dtype = dtype
+        self.weights = {}
+        if model is not None:
+            self.load_model(model)
+
+    def load_model(self, model_path):
+        """ load the weights of a ValueNet checkpoint """
+        weights = read_checkpoint(model_path)
+        self.weights = {}
+        for layer in self.TRUNK + (self.ACTION_CONV, self.EVALUATION_CONV,
+                                   self.ACTION_FC, self.EVALUATION_FC1, self.EVALUATION_FC2):
+            kernel = weights[layer + '/kernel']
+            # (kh, kw, in, out) -> (kh * kw * in, out), the order of the im2col columns
+            self.weights[layer] = (kernel.reshape(-1, kernel.shape[-1]).astype(self.dtype),
+                                   weights[layer + '/bias'].astype(self.dtype))
+
+    def m_rows(self, layer):
+        """ number of inputs of layer (kh * kw * in for a convolution) """
+        return self.weights[layer][0].shape[0]
+
+    def m_conv(self, x, layer):
+        """ 'same' convolution + relu, x: N * h * w * c """
+        bias = self.weights[layer][1]
+        n, h, w, c = x.shape
+        k = int(round((self.m_rows(layer) // c) ** 0.5))
+        if k == 1:
+            cols = x.reshape(n * h * w, c)
+        else:
+            pad = k // 2
+            xp = np.pad(x, ((0, 0), (pad, pad), (pad, pad), (0, 0)))
+            # im2col: the k * k neighbourhood of every point, as one row
+            cols = np.concatenate([xp[:, i:i + h, j:j + w, :] for i in range(k) for j in range(k)],
+                                  axis=3).reshape(n * h * w, k * k * c)
+        out = self.m_matmul(cols, layer)
+        out += bias
+        return np.maximum(out, 0, out=out).reshape(n, h, w, -1)
+
+    def m_dense(self, x, layer):
+        out = self.m_matmul(x, layer)
+        out += self.weights[layer][1]
+        return out
+
+    def m_matmul(self, x, layer):
+        """ x times the kernel of layer, the hook of reduced precision nets """
+        return x @ self.weights[layer][0]
+
+    def policy_value(self, state_batch):
+        """
+        input: a batch of states
+        output: a batch of action probabilities and state values
+        """
+        x = np.asarray(state_batch, dtype=self.dtype).transpose(0, 2, 3, 1)
+        n = len(x)
+        for layer in self.TRUNK:
+            x = self.m_conv(x, layer)
+        # heads, flattened in the same order (h, w, c) as the Tensorflow reshape
+        logits = self.m_dense(self.m_conv(x, self.ACTION_CONV).reshape(n, -1), self.ACTION_FC)
+        logits = logits.astype(np.float32)
+        logits -= logits.max(axis=1, keepdims=True)
+        act_probs = np.exp(logits)
+        act_probs /= act_probs.sum(axis=1, keepdims=True)
+        hidden = np.maximum(self.m_dense(self.m_conv(x, self.EVALUATION_CONV).reshape(n, -1),
+                                         self.EVALUATION_FC1), 0)
+        value = np.tanh(self.m_dense(hidden, self.EVALUATION_FC2).astype(np.float32))
+        return act_probs, value
+
+    def policy_value_fn(self, board):
+        """
+        input: board
+        output: a list of (action, probability) tuples for each available
+        action and the score of the board state
+        """
+        legal_positions = board.available
+        current_state = board.current_state().reshape(-1, 4, self._width, self._height)
+        act_probs, value = self.policy_value(current_state)
+        act_probs = zip(legal_positions, act_probs[0][legal_positions])
+        return act_probs, value
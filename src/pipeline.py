@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+training as a pipeline of processes on one machine:
+actors play self-play games into a queue, the learner trains on them
+without waiting and publishes checkpoints, which the actors and the
+evaluator pick up as soon as they appear
+python pipeline.py
+"""
+import glob
+import json
+import os
+import queue
+import time
+
+from board import Board, Game
+from mcts import AI_MCTS_Player
+from policyValueNet import ValueNet
+from spawn import spawn_context
+from train import Train
+
+LATEST = 'latest.json'
+
+
+def publish(net, model_dir, version, keep=3):
+    """
+    save the weights as checkpoint version and make it the latest one,
+    the checkpoints older than the last keep are removed
+    """
+    path = os.path.join(model_dir, 'policy_{}'.format(version))
+    net.save_model(path)
+    tmp = os.path.join(model_dir, LATEST + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump({'version': version, 'path': path}, f)
+    # readers see the old or the new checkpoint, never a partial one
+    os.replace(tmp, os.path.join(model_dir, LATEST))
+    for old in glob.glob(os.path.join(model_dir, 'policy_{}.*'.format(version - keep))):
+        os.remove(old)
+
+
+def latest_checkpoint(model_dir):
+    """ (version, path) of the latest published checkpoint, or None """
+    try:
+        with open(os.path.join(model_dir, LATEST)) as f:
+            latest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return latest['version'], latest['path']
+
+
+def refresh(net, model_dir, version):
+    """ load the latest checkpoint into net if it is newer than version, return the version of net """
+    latest = latest_checkpoint(model_dir)
+    if latest is None or latest[0] == version:
+        return version
+    try:
+        net.load_model(latest[1])
+    except Exception as e:
+        # removed meanwhile by a newer one, next time
+        print('[WARNING] loading checkpoint {}: {}'.format(latest[0], e))
+        return version
+    return latest[0]
+
+
+def actor(games, stop, model_dir, width=8, height=8, c=4, n_playout=5, tmp=1.0):
+    """
+    self-play process, puts (version, winner, play_data) into games
+    until stop is set, with the weights of the latest checkpoint
+    """
+    net = ValueNet(width, height, inference=True)
+    version = None
+    game = Game(Board(width, height))
+    player = AI_MCTS_Player(net.policy_value_fn, c, n_playout, True)
+    while not stop.is_set():
+        version = refresh(net, model_dir, version)
+        winner, play_data = game.start_self_play(player, p=tmp, shown=False)
+        item = (version, winner, list(play_data))
+        while not stop.is_set():
+            try:
+                games.put(item, timeout=1.0)
+                break
+            except queue.Full:
+                # the learner is behind, wait for it
+                continue
+
+
+def learner(games, stop, model_dir, model=None, data_dir=None, publish_every=10, steps=None):
+    """
+    training process, takes the games from the actors as they come,
+    trains on the buffer and publishes a checkpoint every publish_every updates
+    steps: stop after that many updates, None runs until stop is set
+    """
+    trainer = Train(model, data_dir=data_dir)
+    version = 0
+    publish(trainer.policy_val_net, model_dir, version)
+    step = 0
+    try:
+        while not stop.is_set() and (steps is None or step < steps):
+            # everything the actors played since last time, only wait
+            # for a game while the buffer is too small to train on
+            while True:
+                try:
+                    if not trainer.can_update():
+                        item = games.get(timeout=1.0)
+                    else:
+                        item = games.get_nowait()
+                except queue.Empty:
+                    break
+                _, winner, play_data = item
+                trainer.episode = len(play_data)
+                trainer.data_buffer.extend(play_data)
+                trainer.save_data(play_data)
+            if not trainer.can_update():
+                continue
+            trainer.policy_update(step)
+            step += 1
+            if step % publish_every == 0:
+                version += 1
+                publish(trainer.policy_val_net, model_dir, version)
+                if trainer.writer is not None:
+                    trainer.writer.flush()
+    finally:
+        trainer.close()
+        stop.set()
+
+
+def evaluator(stop, model_dir, interval=60.0):
+    """ evaluate each new checkpoint against pure MCTS, keep the best, see Train.check_model """
+    trainer = Train()
+    version = None
+    while not stop.is_set():
+        new = refresh(trainer.policy_val_net, model_dir, version)
+        if new == version:
+            stop.wait(interval)
+            continue
+        version = new
+        print('checkpoint {}'.format(version))
+        trainer.check_model()
+
+
+class Pipeline(object):
+    """ actors, learner and evaluator processes """
+
+    def __init__(self, actors=4, model=None, model_dir='./pipeline', data_dir=None,
+                 queue_size=64, evaluate=True):
+        """
+        actors: number of self-play processes
+        model: checkpoint to start from
+        model_dir: where the checkpoints are published
+        data_dir: dataset the games are also written to, see dataset.py
+        queue_size: games waiting for the learner at most, then the actors wait
+        evaluate: run the evaluator process too
+        """
+        self.actors = actors
+        self.model = model
+        self.model_dir = model_dir
+        self.data_dir = data_dir
+        self.queue_size = queue_size
+        self.evaluate = evaluate
+
+    def run(self, steps=None):
+        """ run until steps updates (forever if None) or Ctrl-C """
+        os.makedirs(self.model_dir, exist_ok=True)
+        if os.path.exists(os.path.join(self.model_dir, LATEST)):
+            # left by an earlier run, the actors wait for ours
+            os.remove(os.path.join(self.model_dir, LATEST))
+        ctx = spawn_context()
+        games = ctx.Queue(self.queue_size)
+        stop = ctx.Event()
+        learn = ctx.Process(target=learner, name='learner',
+                            args=(games, stop, self.model_dir, self.model, self.data_dir),
+                            kwargs={'steps': steps})
+        learn.start()
+        # the actors start from the first checkpoint of the learner
+        while latest_checkpoint(self.model_dir) is None and learn.is_alive():
+            time.sleep(0.1)
+        procs = [ctx.Process(target=actor, name='actor-{}'.format(i), args=(games, stop, self.model_dir))
+                 for i in range(self.actors)]
+        if self.evaluate:
+            procs.append(ctx.Process(target=evaluator, name='evaluator', args=(stop, self.model_dir)))
+        for p in procs:
+            p.start()
+        try:
+            learn.join()
+        except KeyboardInterrupt:
+            print('quit by user')
+        finally:
+            stop.set()
+            learn.join()
+            for p in procs:
+                p.join(timeout=30)
+                if p.is_alive():
+                    p.terminate()
+            # let the queue feeder threads finish
+            games.cancel_join_thread()
+
+
+if __name__ == '__main__':
+    Pipeline().run()
@@ -16,12 +16,49 @@ import tensorflow as tf
 
 
 class ValueNet(object):
-    def __init__(self, width=8, height=8, model=None):
+    def __init__(self, width=8, height=8, model=None, inference=False, frozen=None, warmup=False):
+        """
+        model: checkpoint to restore
+        inference: build the forward pass only (no loss, optimizer, summaries
+        or log writer), for playing, train_step is not available then
+        frozen: load this frozen graph, see export_frozen, instead of building one
+        warmup: run a dummy batch at once, so the first move is not the slow one
+        """
         self._width = width
         self._height = height
+        self.inference = inference or frozen is not None
+        # a graph of its own, several networks can live in one process
+        self.graph = tf.Graph()
+        if frozen is not None:
+            self.load_frozen(frozen)
+        else:
+            with self.graph.as_default():
+                self.build_forward(width, height)
+                if not self.inference:
+                    self.build_train(width, height)
+                # Make a session
+                self.session = tf.Session(graph=self.graph)
+                # Initialize variables
+                init = tf.global_variables_initializer()
+                self.session.run(init)
+
+                # For saving and restoring
+                self.saver = tf.train.Saver()
+                if model is not None:
+                    self.load_model(model)
+
+                if not self.inference:
+                    # saving logs
+                    self.merged = tf.summary.merge_all()
+                    self.writer = tf.summary.FileWriter("logs/")
+        if warmup:
+            self.policy_value(np.zeros((1, 4, width, height), np.float32))
+
+    def build_forward(self, width, height):
+        """ the network, from the input states to the policy and the value """
         # CNN Convolution Neural Network
         # Step 1. Input data
-        self.input_state = tf.placeholder(tf.float32, shape=[None, 4, width, height])
+        self.input_state = tf.placeholder(tf.float32, shape=[None, 4, width, height], name='input_state')
         self.input_states = tf.transpose(self.input_state, [0, 2, 3, 1])
         # Step 2. Convolution
         # Conv1
@@ -64,6 +101,12 @@ class ValueNet(object):
         # the score of evaluation on current state
         self.evaluation_fc2 = tf.layers.dense(inputs=self.evaluation_fc1,
                                               units=1, activation=tf.nn.tanh)
+        # names of the outputs in a frozen graph
+        tf.identity(self.action_fc, name='log_policy')
+        tf.identity(self.evaluation_fc2, name='value')
+
+    def build_train(self, width, height):
+        """ loss and optimizer, for training only """
         # Label: win or not
         self.labels = tf.placeholder(tf.float32, shape=[None, 1])
 
@@ -88,25 +131,10 @@ class ValueNet(object):
         self.learning_rate = tf.placeholder(tf.float32)
         self.optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate).minimize(self.loss)
 
-        # Make a session
-        self.session = tf.Session()
-
         # calc policy entropy, for monitoring only
         self.entropy = tf.negative(tf.reduce_mean(
             tf.reduce_sum(tf.exp(self.action_fc) * self.action_fc, 1)))
         tf.summary.scalar('entropy', self.entropy)
-        # Initialize variables
-        init = tf.global_variables_initializer()
-        self.session.run(init)
-
-        # For saving and restoring
-        self.saver = tf.train.Saver()
-        if model is not None:
-            self.load_model(model)
-
-        # saving logs
-        self.merged = tf.summary.merge_all()
-        self.writer = tf.summary.FileWriter("logs/")
 
     def policy_value(self, state_batch):
         """
@@ -133,6 +161,7 @@ class ValueNet(object):
         return act_probs, value
 
     def train_step(self, state_batch, mcts_probs, winner_batch, lr, step: int):
+        assert not self.inference, 'network built for inference only'
         winner_batch = np.reshape(winner_batch, (-1, 1))
         loss, entropy, _ = self.session.run(
             [self.loss, self.entropy, self.optimizer],
@@ -152,8 +181,30 @@ class ValueNet(object):
 
     def save_model(self, model_path):
         """ save model to local file """
+        assert self.saver is not None, 'frozen graph, no variables to save'
         self.saver.save(self.session, model_path)
 
     def load_model(self, model_path):
         """ load model from local file """
+        assert self.saver is not None, 'frozen graph, no variables to load'
         self.saver.restore(self.session, model_path)
+
+    def export_frozen(self, path):
+        """ save the forward pass with the weights as constants in one file """
+        graph_def = tf.graph_util.convert_variables_to_constants(
+            self.session, self.graph.as_graph_def(), ['log_policy', 'value'])
+        with tf.gfile.GFile(path, 'wb') as f:
+            f.write(graph_def.SerializeToString())
+
+    def load_frozen(self, path):
+        """ load a graph saved by export_frozen """
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.input_state = self.graph.get_tensor_by_name('input_state:0')
+        self.action_fc = self.graph.get_tensor_by_name('log_policy:0')
+        self.evaluation_fc2 = self.graph.get_tensor_by_name('value:0')
+        self.session = tf.Session(graph=self.graph)
+        self.saver = None
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+accuracy and strength of the policy-value network at reduced precision,
+a simulator: it tells what a float16 / int8 kernel would cost in accuracy
+and games before writing one, it is neither faster nor smaller than NumpyNet
+  float16: weights rounded to float16
+  int8: weights quantized per output channel, activations per layer
+        with scales calibrated on stored self-play positions
+numpy has no int8 nor float16 matrix product: the weights are kept in
+float32 holding the quantized values, the products are exact in float32
+(the int8 sums stay below 2 ** 24), so the results are the ones of real
+reduced precision kernels
+calibrating int8 takes a few seconds, the scales can be saved once and
+given to the next loads:
+    QuantizedNet(model=model, data_dir=data_dir).save_scales(path)
+python quantize.py
+"""
+import os
+import random
+import zipfile
+
+import numpy as np
+
+from board import Board
+from numpyNet import NumpyNet
+
+
+def calibration_states(n=2000, data_dir=None, seed=0):
+    """
+    n positions to calibrate on: sampled from the self-play dataset
+    at data_dir (see dataset.py) or, without one, from random games
+    """
+    if data_dir is not None:
+        from dataset import ShardDataset
+        return ShardDataset(data_dir).sample(n, np.random.RandomState(seed))[0]
+    rng = random.Random(seed)
+    states = []
+    while len(states) < n:
+        b = Board()
+        b.init_board(0)
+        while not b.game_end()[0] and len(states) < n:
+            states.append(b.current_state())
+            b.draw(rng.choice(b.available))
+    return np.array(states)
+
+
+class QuantizedNet(NumpyNet):
+    """ NumpyNet computing the results of float16 or int8 weights """
+
+    def __init__(self, width=8, height=8, model=None, mode='int8', calibration=None, percentile=99.99,
+                 data_dir=None, scales=None):
+        """
+        mode: 'float16' or 'int8'
+        calibration: states the int8 activation ranges are taken from,
+        if None: the self-play positions of the dataset at data_dir (see dataset.py),
+        random games without one
+        percentile: of the absolute activations taken as their range,
+        the few larger ones are clipped
+        scales: file written by save_scales, used instead of calibrating
+        if it can be read and has the same percentile
+        """
+        assert mode in ('float16', 'int8'), 'Invalid mode!'
+        self.mode = mode
+        self.calibration = calibration
+        self.percentile = percentile
+        self.data_dir = data_dir
+        self.scales = scales
+        # per layer: scale of the input (int8), scales of the output channels (int8)
+        self.m_act_scale = {}
+        self.m_w_scale = {}
+        # ranges of the layer inputs while calibrating
+        self.m_stats = None
+        NumpyNet.__init__(self, width, height, model)
+
+    def load_model(self, model_path):
+        """ load the weights of a ValueNet checkpoint and quantize them, kept in float32 """
+        NumpyNet.load_model(self, model_path)
+        if self.mode == 'int8' and (self.scales is None or not self.m_load_scales(self.scales)):
+            self.calibrate(calibration_states(data_dir=self.data_dir) if self.calibration is None
+                           else self.calibration)
+        for layer, (kernel, bias) in self.weights.items():
+            if self.mode == 'float16':
+                kernel = kernel.astype(np.float16).astype(np.float32)
+            else:
+                # symmetric, one scale per output channel, the kernel holds the int8 values
+                scale = np.maximum(np.abs(kernel).max(axis=0), 1e-12) / 127.0
+                kernel = np.clip(np.rint(kernel / scale), -127, 127).astype(np.float32)
+                self.m_w_scale[layer] = scale.astype(np.float32)
+            self.weights[layer] = (kernel, bias)
+
+    def m_load_scales(self, path):
+        """ the saved activation scales, False if missing, unreadable or calibrated otherwise """
+        try:
+            with np.load(path) as saved:
+                if float(saved['percentile']) != self.percentile:
+                    return False
+                self.m_act_scale = {layer: float(saved[layer]) for layer in self.weights}
+        except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile):
+            self.m_act_scale = {}
+            return False
+        return True
+
+    def save_scales(self, path):
+        """ save the int8 activation scales, replaced at once so readers never see half a file """
+        assert self.mode == 'int8', 'only int8 nets have activation scales'
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez(f, percentile=self.percentile, data_dir=str(self.data_dir), **self.m_act_scale)
+        os.replace(tmp, path)
+
+    def calibrate(self, states, batch_size=256):
+        """ input ranges of every layer on states, with the float32 weights """
+        self.m_stats = {}
+        for i in range(0, len(states), batch_size):
+            NumpyNet.policy_value(self, states[i:i + batch_size])
+        for layer, ranges in self.m_stats.items():
+            self.m_act_scale[layer] = max(float(np.max(ranges)), 1e-12) / 127.0
+        self.m_stats = None
+
+    def m_matmul(self, x, layer):
+        if self.m_stats is not None:
+            # calibrating, still float32
+            self.m_stats.setdefault(layer, []).append(np.percentile(np.abs(x), self.percentile))
+            return x @ self.weights[layer][0]
+        if self.mode == 'float16':
+            return x @ self.weights[layer][0]
+        scale = self.m_act_scale[layer]
+        q = x * np.float32(1.0 / scale)
+        np.rint(q, out=q)
+        np.clip(q, -127, 127, out=q)
+        out = q @ self.weights[layer][0]
+        out *= scale * self.m_w_scale[layer]
+        return out
+
+    @property
+    def nbytes(self):
+        """ memory of the weights held, the same as NumpyNet and its float32 weights """
+        return (sum(k.nbytes + b.nbytes for k, b in self.weights.values()) +
+                sum(s.nbytes for s in self.m_w_scale.values()))
+
+
+def compare(reference, net, states):
+    """
+    accuracy of net against reference (e.g. the float32 NumpyNet) on states:
+    mean and max KL divergence of the policies, mean and max value error,
+    how often both pick the same best legal move
+    """
+    p_ref, v_ref = reference.policy_value(states)
+    p, v = net.policy_value(states)
+    kl = np.sum(p_ref * (np.log(p_ref + 1e-10) - np.log(p + 1e-10)), axis=1)
+    err = np.abs(v_ref - v).flatten()
+    legal = np.asarray(states)[:, 2].reshape(len(states), -1) > 0
+    top1 = np.argmax(np.where(legal, p_ref, -1), axis=1) == np.argmax(np.where(legal, p, -1), axis=1)
+    return {'kl': float(kl.mean()), 'kl_max': float(kl.max()),
+            'value_err': float(err.mean()), 'value_err_max': float(err.max()),
+            'top1': float(top1[legal.any(axis=1)].mean())}
+
+
+if __name__ == '__main__':
+    model = './model/best_94_policy_model'
+    reference = NumpyNet(model=model)
+    # calibrate and check on different positions
+    test = calibration_states(1000, seed=1)
+    for mode in ('float16', 'int8'):
+        net = QuantizedNet(model=model, mode=mode)
+        print('{}: {}'.format(mode, compare(reference, net, test)))
+    # strength, int8 against float32, the workers load the scales calibrated above
+    import tempfile
+    from arena import Arena
+    scales = os.path.join(tempfile.mkdtemp(), 'int8_scales.npz')
+    net.save_scales(scales)
+    arena = Arena()
+    try:
+        print(arena.match({'type': 'net', 'model': model, 'backend': 'int8', 'playout': 100, 'scales': scales},
+                          {'type': 'net', 'model': model, 'backend': 'numpy', 'playout': 100}, games=100))
+    finally:
+        arena.close()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+replay buffer of self-play positions for training
+preallocated numpy ring: the four 0/1 planes of a state are bit-packed
+into 32 bytes, policies are float16 and outcomes int8
+"""
+import numpy as np
+
+import symmetry
+
+
+def distinct(rng, population, n):
+    """
+    n distinct integers below population, in random order, drawn with
+    replacement and redrawn on collisions: the cost depends on n, not on
+    population (a choice without replacement shuffles all of population)
+    """
+    assert n <= population, 'not enough samples'
+    if 2 * n > population:
+        return rng.choice(population, n, replace=False)
+    pick = np.unique(rng.randint(population, size=n))
+    while len(pick) < n:
+        pick = np.unique(np.concatenate([pick, rng.randint(population, size=n - len(pick))]))
+    return rng.permutation(pick)
+
+
+class ReplayBuffer(object):
+    """ the last size positions (state, mcts_p, winner_score) """
+
+    def __init__(self, size, width=8, height=8, p_dtype=np.float16):
+        """
+        size: max number of positions, the oldest are overwritten
+        p_dtype: dtype the policies are kept in
+        """
+        self.size = size
+        self.width = width
+        self.height = height
+        self.m_planes = 4
+        self.m_states = np.zeros((size, self.m_planes * width * height // 8), np.uint8)
+        self.m_probs = np.zeros((size, width * height), p_dtype)
+        self.m_winners = np.zeros(size, np.int8)
+        # next row to write, number of rows filled
+        self.m_pos = 0
+        self.m_count = 0
+
+    def add(self, states, mcts_p, winners):
+        """
+        add a batch of positions
+        states: N * 4 * w * h of 0/1, mcts_p: N * (w * h), winners: N of -1/0/1
+        """
+        states = np.asarray(states)
+        self.add_packed(np.packbits(states.reshape(len(states), -1) != 0, axis=1), mcts_p, winners)
+
+    def add_packed(self, states, mcts_p, winners):
+        """ add a batch of positions whose states are already bit-packed, N * 32 uint8 """
+        n = len(states)
+        if n == 0:
+            return
+        if n > self.size:
+            # only the last size ones would stay
+            states, mcts_p, winners = states[-self.size:], mcts_p[-self.size:], winners[-self.size:]
+            n = self.size
+        rows = (self.m_pos + np.arange(n)) % self.size
+        self.m_states[rows] = states
+        self.m_probs[rows] = np.asarray(mcts_p).reshape(n, -1)
+        self.m_winners[rows] = np.asarray(winners)
+        self.m_pos = (self.m_pos + n) % self.size
+        self.m_count = min(self.m_count + n, self.size)
+
+    def extend(self, play_data):
+        """ add a list of (state, mcts_p, winner_score), like deque.extend """
+        play_data = list(play_data)
+        if not play_data:
+            return
+        states, mcts_p, winners = zip(*play_data)
+        self.add(np.array(states), np.array(mcts_p), np.array(winners))
+
+    def rows(self, index):
+        """ unpacked (states, mcts_p, winners) of the rows index, as float32 """
+        n = len(index)
+        states = np.unpackbits(self.m_states[index], axis=1).reshape(
+            n, self.m_planes, self.width, self.height).astype(np.float32)
+        return (states, self.m_probs[index].astype(np.float32),
+                self.m_winners[index].astype(np.float32))
+
+    def sample(self, n, rng=np.random, augment=False):
+        """
+        n distinct random positions, see rows
+        augment: n distinct (position, symmetry of the board) pairs instead,
+        so the buffer keeps each position once instead of its 8 symmetries,
+        at most samples(True) of them
+        """
+        if not augment:
+            return self.rows(distinct(rng, self.m_count, n))
+        pick = distinct(rng, self.m_count * symmetry.N_SYMMETRY, n)
+        states, mcts_p, winners = self.rows(pick // symmetry.N_SYMMETRY)
+        k = pick % symmetry.N_SYMMETRY
+        return symmetry.transform_states(states, k), symmetry.transform_policies(mcts_p, k), winners
+
+    def samples(self, augment=False):
+        """ number of distinct samples, see sample """
+        return self.m_count * symmetry.N_SYMMETRY if augment else self.m_count
+
+    def __len__(self):
+        return self.m_count
+
+    @property
+    def nbytes(self):
+        return self.m_states.nbytes + self.m_probs.nbytes + self.m_winners.nbytes
+
+    def __str__(self):
+        return 'ReplayBuffer({}/{}, {:.1f} MB)'.format(self.m_count, self.size, self.nbytes / 2 ** 20)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+vectorized random rollouts
+many games are played at once on numpy arrays of bitboards (uint64),
+move generation, random move choice and flips run for the whole batch each ply
+"""
+import numpy as np
+
+import bitboard
+
+_INNER = np.uint64(bitboard.INNER)
+_ZERO = np.uint64(0)
+_ONE = np.uint64(1)
+# the four shifts, along a new first axis: (0, 1), (1, 0), (1, 1), (1, -1),
+# each applied towards higher and lower points
+_SHIFT = np.array([[1], [8], [9], [7]], np.uint64)
+_SHIFT2 = _SHIFT * np.uint64(2)
+
+
+def popcount(b):
+    """ number of pieces of each mask in the uint64 array b """
+    b = np.ascontiguousarray(b, dtype='<u8')
+    return np.unpackbits(b.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def _runs(opp):
+    """
+    opponent pieces which can be part of a run in each direction,
+    a horizontal or diagonal run can not wrap around a row
+    """
+    inner = opp & _INNER
+    return np.stack((inner, opp, inner, inner))
+
+
+def legal_moves(own, opp):
+    """ legal moves of own, for uint64 arrays own and opp """
+    m = _runs(opp)
+    own = own[None]
+    moves = np.zeros_like(m)
+    for shift in (np.left_shift, np.right_shift):
+        # runs of at most 6 opponent pieces next to own pieces
+        pre = m & shift(m, _SHIFT)
+        t = m & shift(own, _SHIFT)
+        t |= m & shift(t, _SHIFT)
+        t |= pre & shift(t, _SHIFT2)
+        t |= pre & shift(t, _SHIFT2)
+        moves |= shift(t, _SHIFT)
+    return np.bitwise_or.reduce(moves, axis=0) & ~(own[0] | opp)
+
+
+def flips(own, opp, move):
+    """ pieces of opp eaten by own playing the one-bit masks in move """
+    m = _runs(opp)
+    own = own[None]
+    move = move[None]
+    flipped = np.zeros_like(m)
+    for shift in (np.left_shift, np.right_shift):
+        # run of opponent pieces from the move, eaten if own piece behind
+        f = shift(move, _SHIFT) & m
+        for i in range(5):
+            f |= shift(f, _SHIFT) & m
+        flipped |= np.where(shift(f, _SHIFT) & own, f, _ZERO)
+    return np.bitwise_or.reduce(flipped, axis=0)
+
+
+def random_moves(moves, rng=np.random):
+    """ one uniformly random move (as one-bit mask) out of each non empty mask """
+    bits = np.unpackbits(np.ascontiguousarray(moves, dtype='<u8').view(np.uint8).reshape(-1, 8),
+                         axis=1, bitorder='little')
+    cum = np.cumsum(bits, axis=1)
+    k = (rng.random_sample(len(moves)) * cum[:, -1]).astype(cum.dtype)
+    point = np.argmax(cum > k[:, None], axis=1).astype(np.uint64)
+    return _ONE << point
+
+
+def rollout(own, opp, rng=np.random):
+    """
+    play random games from the positions (own to move) until game over
+    own, opp: uint64 arrays (or ints) of the same length
+    return int8 array, 1 if own wins, -1 if it is lost and 0 if it is a tie
+    """
+    own = np.array(own, dtype=np.uint64, ndmin=1)
+    opp = np.array(opp, dtype=np.uint64, ndmin=1)
+    n = len(own)
+    # +1 while the side to move is own of the start position
+    sign = np.ones(n, np.int8)
+    result = np.zeros(n, np.int8)
+    active = np.arange(n)
+    while len(active):
+        moves = legal_moves(own, opp)
+        stuck = moves == 0
+        if stuck.any():
+            # no move: pass, or game over if the opponent can not move either
+            over = stuck & (legal_moves(opp, own) == 0)
+            if over.any():
+                diff = popcount(own[over]).astype(np.int32) - popcount(opp[over])
+                result[active[over]] = np.sign(diff) * sign[over]
+                keep = ~over
+                own, opp, sign, moves, stuck, active = \
+                    own[keep], opp[keep], sign[keep], moves[keep], stuck[keep], active[keep]
+        play = ~stuck
+        move = np.zeros_like(own)
+        move[play] = random_moves(moves[play], rng)
+        eaten = flips(own, opp, move)
+        # the side to move changes, also for a pass
+        own, opp = opp ^ eaten, own | eaten | move
+        sign = -sign
+    return result
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+many online games served by one process
+every game id has its own board and search tree, all of them share
+one loaded network, whose calls are merged into batches across games
+"""
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+from board import Board
+from Human import PlayOnline
+
+
+class Coalescer(object):
+    """
+    puts itself in front of the network (ValueNet) and evaluates the
+    states sent by many threads, e.g. one per game, in one policy_value call
+    """
+
+    def __init__(self, net, max_batch=256, wait_ms=1.0, width=8, height=8):
+        """
+        net: the shared network, anything with policy_value(state_batch)
+        max_batch: max number of states in one network call
+        wait_ms: time to wait for more states once the first one arrived
+        """
+        self.m_net = net
+        self.m_max_batch = max_batch
+        self.m_wait = wait_ms / 1000.0
+        self.m_width = width
+        self.m_height = height
+        self.m_queue = queue.Queue()
+        # statistics, states evaluated and network calls
+        self.states = 0
+        self.calls = 0
+        self.m_thread = threading.Thread(target=self.m_run, daemon=True)
+        self.m_thread.start()
+
+    def m_run(self):
+        while True:
+            pending = [self.m_queue.get()]
+            n = len(pending[0][0])
+            deadline = time.perf_counter() + self.m_wait
+            # gather what the other games send in the meantime
+            while n < self.m_max_batch:
+                left = deadline - time.perf_counter()
+                try:
+                    item = self.m_queue.get(timeout=left) if left > 0 else self.m_queue.get_nowait()
+                except queue.Empty:
+                    break
+                pending.append(item)
+                n += len(item[0])
+            states = np.concatenate([s for s, f in pending])
+            try:
+                act_probs, value = self.m_net.policy_value(states)
+            except Exception as e:
+                for s, f in pending:
+                    f.set_exception(e)
+                continue
+            self.states += n
+            self.calls += 1
+            start = 0
+            for s, f in pending:
+                end = start + len(s)
+                f.set_result((act_probs[start:end], value[start:end]))
+                start = end
+
+    def policy_value(self, state_batch):
+        """ same as ValueNet.policy_value, blocks until the batch is evaluated """
+        future = Future()
+        self.m_queue.put((np.asarray(state_batch, dtype=np.float32), future))
+        return future.result()
+
+    def policy_value_fn(self, board: Board):
+        """ same as ValueNet.policy_value_fn """
+        legal_positions = board.available
+        current_state = board.current_state().reshape(-1, 4, self.m_width, self.m_height)
+        act_probs, value = self.policy_value(current_state)
+        act_probs = zip(legal_positions, act_probs[0][legal_positions])
+        return act_probs, value
+
+    def __str__(self):
+        return 'Coalescer(states:{}, calls:{}, mean batch:{:.1f})'.format(
+            self.states, self.calls, self.states / self.calls if self.calls else 0.0)
+
+
+class Job(object):
+    """ a move being searched in the background, with its progress """
+
+    def __init__(self, job_id, game_id):
+        self.job_id = job_id
+        self.game_id = game_id
+        # pending, running, done or error
+        self.state = 'pending'
+        self.progress = None
+        self.result = None
+        # bumped at every change, for the clients waiting on it
+        self.version = 0
+        self.m_cond = threading.Condition()
+
+    def m_set(self, **kwargs):
+        with self.m_cond:
+            for k, v in kwargs.items():
+                setattr(self, k, v)
+            self.version += 1
+            self.m_cond.notify_all()
+
+    def is_done(self):
+        return self.state in ('done', 'error')
+
+    def wait(self, since=-1, timeout=None):
+        """ wait until version is newer than since or the job is done, return snapshot() """
+        with self.m_cond:
+            self.m_cond.wait_for(lambda: self.version > since or self.is_done(), timeout)
+            return self.snapshot()
+
+    def snapshot(self):
+        return {"job": self.job_id,
+                "game": self.game_id,
+                "state": self.state,
+                "version": self.version,
+                "progress": self.progress,
+                "result": self.result}
+
+
+class SessionManager(object):
+    """ the games being played, by game id """
+
+    def __init__(self, net, max_sessions=1000, ttl=3600, batch_size=8,
+                 max_batch=256, wait_ms=1.0, level='normal', ponder=False,
+                 search_workers=32, max_jobs=10000, book=None, endgame=None):
+        """
+        net: the loaded network, shared by all the games
+        max_sessions: games kept at most, the least recently played is dropped
+        ttl: seconds after which an idle game is dropped
+        batch_size: leaves evaluated together by the search of one game,
+        the coalescer merges them with the leaves of the other games
+        level: default difficulty of new games, see PlayOnline.LEVELS
+        ponder: let each game search while its human thinks, costly with many games
+        search_workers: threads running the searches of submit
+        max_jobs: jobs kept for their clients, the oldest finished ones are dropped
+        book: opening Book, read-only, shared by all the games
+        endgame: empty points from which the games are solved exactly, see PlayOnline,
+        the solvers of all the games share one bounded transposition table
+        """
+        self.coalescer = Coalescer(net, max_batch, wait_ms)
+        self.m_max_sessions = max_sessions
+        self.m_ttl = ttl
+        self.m_batch_size = batch_size
+        self.m_level = level
+        self.m_ponder = ponder
+        self.m_book = book
+        self.m_endgame = endgame
+        self.m_endgame_table = {}
+        # game id -> [PlayOnline, lock, last used time]
+        self.m_sessions = {}
+        self.m_lock = threading.Lock()
+        # the searches run here, not in the threads serving the requests
+        self.m_executor = ThreadPoolExecutor(search_workers)
+        self.m_max_jobs = max_jobs
+        self.m_jobs = OrderedDict()
+
+    def create(self, game_id=None, level=None):
+        """ start a new game, return its id """
+        game_id = game_id or uuid.uuid4().hex
+        game = PlayOnline(self.m_ponder, level or self.m_level, self.m_batch_size, self.m_book,
+                          self.m_endgame, self.m_endgame_table)
+        game.init(None, net=self.coalescer)
+        with self.m_lock:
+            self.m_expire()
+            while len(self.m_sessions) >= self.m_max_sessions:
+                oldest = min(self.m_sessions, key=lambda g: self.m_sessions[g][2])
+                self.m_sessions.pop(oldest)[0].stop_ponder()
+            self.m_sessions[game_id] = [game, threading.Lock(), time.time()]
+        return game_id
+
+    def m_expire(self):
+        """ drop the games idle for more than ttl, lock held """
+        now = time.time()
+        for game_id in [g for g, s in self.m_sessions.items() if now - s[2] > self.m_ttl]:
+            self.m_sessions.pop(game_id)[0].stop_ponder()
+
+    def m_get(self, game_id):
+        with self.m_lock:
+            # every request looks for idle games, not only the new ones
+            self.m_expire()
+            session = self.m_sessions.get(game_id)
+            if session is not None:
+                session[2] = time.time()
+            return session
+
+    def restart(self, game_id=None, level=None):
+        """ restart the game, or create it if unknown, return its id """
+        session = self.m_get(game_id) if game_id else None
+        if session is None:
+            return self.create(game_id, level)
+        game, lock, _ = session
+        with lock:
+            game.reset(level)
+        return game_id
+
+    def play(self, game_id, point: int, role: int):
+        """ PlayOnline.AI_play_online of the game, None if the game is unknown """
+        session = self.m_get(game_id)
+        if session is None:
+            return None
+        game, lock, _ = session
+        # one move at a time per game, the other games go on meanwhile
+        with lock:
+            return game.AI_play_online(point, role)
+
+    def submit(self, game_id, point: int, role: int):
+        """
+        play like play, in the background, return the Job at once
+        or None if the game is unknown, the Job gets the progress of the search
+        and the result of play
+        """
+        session = self.m_get(game_id)
+        if session is None:
+            return None
+        job = Job(uuid.uuid4().hex, game_id)
+        with self.m_lock:
+            self.m_jobs[job.job_id] = job
+            while len(self.m_jobs) > self.m_max_jobs:
+                oldest = next((j for j, v in self.m_jobs.items() if v.is_done()), None)
+                if oldest is None:
+                    break
+                del self.m_jobs[oldest]
+
+        def work():
+            game, lock, _ = session
+            with lock:
+                job.m_set(state='running')
+                try:
+                    res = game.AI_play_online(point, role, lambda p: job.m_set(progress=p))
+                except Exception as e:
+                    job.m_set(state='error', result={"error": True, "message": str(e)})
+                else:
+                    job.m_set(state='done', result=res)
+
+        self.m_executor.submit(work)
+        return job
+
+    def job(self, job_id):
+        with self.m_lock:
+            return self.m_jobs.get(job_id)
+
+    def drop(self, game_id):
+        with self.m_lock:
+            session = self.m_sessions.pop(game_id, None)
+        if session is not None:
+            session[0].stop_ponder()
+
+    def __len__(self):
+        return len(self.m_sessions)
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+worker processes started clean (spawn) instead of forked,
+tensorflow does not survive fork
+"""
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+
+def spawn_context():
+    """ multiprocessing context whose processes are spawned """
+    return multiprocessing.get_context('spawn')
+
+
+def spawn_executor(workers):
+    """ ProcessPoolExecutor of workers spawned processes """
+    if sys.version_info >= (3, 7):
+        return ProcessPoolExecutor(workers, mp_context=spawn_context())
+    # python 3.6: the executor takes no context, it uses the default start method
+    multiprocessing.set_start_method('spawn', force=True)
+    return ProcessPoolExecutor(workers)
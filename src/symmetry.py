@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+the 8 symmetries of the square board (4 rotations, each one also flipped)
+as permutations of the points, applied the same way to state planes and
+to policies, which are both indexed by point = x * width + y
+"""
+import numpy as np
+
+
+def _tables(width=8, height=8):
+    points = np.arange(width * height).reshape(width, height)
+    perms = []
+    for i in range(4):
+        rot = np.rot90(points, i)
+        perms.append(rot.flatten())
+        perms.append(np.fliplr(rot).flatten())
+    perms = np.array(perms)
+    inverse = np.argsort(perms, axis=1)
+    return perms, inverse
+
+
+# transformed[k] = x[PERMS[k]], and x = transformed[k][INVERSE[k]]
+# PERMS[0] is the identity
+PERMS, INVERSE = _tables()
+N_SYMMETRY = len(PERMS)
+
+
+def _bit_tables():
+    """ per symmetry, byte position and byte value: the transformed bits """
+    tables = []
+    for k in range(N_SYMMETRY):
+        # the point p goes to INVERSE[k][p]
+        bits = [1 << int(j) for j in INVERSE[k]]
+        table = []
+        for i in range(8):
+            row = [0] * 256
+            for v in range(1, 256):
+                low = v & -v
+                row[v] = row[v ^ low] | bits[8 * i + low.bit_length() - 1]
+            table.append(row)
+        tables.append(table)
+    return tables
+
+
+_BITS = _bit_tables()
+
+
+def transform_bits(b: int, k: int):
+    """ a bitboard mask under symmetry k, consistent with transform_states """
+    t = _BITS[k]
+    return (t[0][b & 0xFF] | t[1][b >> 8 & 0xFF] | t[2][b >> 16 & 0xFF] | t[3][b >> 24 & 0xFF] |
+            t[4][b >> 32 & 0xFF] | t[5][b >> 40 & 0xFF] | t[6][b >> 48 & 0xFF] | t[7][b >> 56])
+
+
+def canonical(own: int, opp: int):
+    """
+    the representative of the 8 symmetric variants of the position (own, opp),
+    return (own', opp', k) with (own', opp') the smallest of them under symmetry k
+    """
+    best = (own, opp, 0)
+    for k in range(1, N_SYMMETRY):
+        t = _BITS[k]
+        a = (t[0][own & 0xFF] | t[1][own >> 8 & 0xFF] | t[2][own >> 16 & 0xFF] | t[3][own >> 24 & 0xFF] |
+             t[4][own >> 32 & 0xFF] | t[5][own >> 40 & 0xFF] | t[6][own >> 48 & 0xFF] | t[7][own >> 56])
+        if a > best[0]:
+            continue
+        b = transform_bits(opp, k)
+        if (a, b) < best[:2]:
+            best = (a, b, k)
+    return best
+
+
+def transform_states(states, k):
+    """
+    states: N * planes * 8 * 8, k: N symmetry indices (or one for all)
+    return the transformed states, a new array
+    """
+    states = np.asarray(states)
+    n, planes = states.shape[:2]
+    index = PERMS[np.broadcast_to(k, (n,))][:, None, :]
+    return np.take_along_axis(states.reshape(n, planes, -1), index, axis=2).reshape(states.shape)
+
+
+def transform_policies(probs, k, inverse=False):
+    """
+    probs: N * 64 values per point, k: N symmetry indices (or one for all)
+    inverse: undo the symmetries k instead
+    """
+    probs = np.asarray(probs)
+    table = INVERSE if inverse else PERMS
+    return np.take_along_axis(probs, table[np.broadcast_to(k, (len(probs),))], axis=1)
+
+
+def transform_point(point, k, inverse=False):
+    """ where the point goes under symmetry k (or comes from, if inverse) """
+    return int((PERMS if inverse else INVERSE)[k][point])
+
+
+def random_symmetry(states, probs, rng=np.random):
+    """ one random symmetry per position, applied to states and probs alike """
+    k = rng.randint(N_SYMMETRY, size=len(states))
+    return transform_states(states, k), transform_policies(probs, k)